@@ -0,0 +1,203 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import time
+import numpy as np
+from refrigerator_sim import load_moer_data
+from simulator import Simulator, parse_policy
+
+# Benchmarked slices of the dataset (number of timesteps from its start), and the Simulator.run modes run on each
+SLICES = {"1day": 288, "1week": 7 * 288, "month": "all"}
+POLICIES = ["no_data", "zeroes", "zeroes_forecast", "zeroes_forecast_hist"]
+
+# Metrics compared against the baseline: (whether higher values are better, smallest absolute change that counts, to
+# ignore timer and allocator noise in tiny values)
+TRACKED_METRICS = {"latency_ms.p50": (False, 0.01), "latency_ms.p99": (False, 0.01), "timesteps_per_sec": (True, 0),
+                   "peak_rss_mb": (False, 5), "plot_secs": (False, 0.05)}
+
+
+class _TimedSimulator(Simulator):
+    """A Simulator that records the wall-clock latency of every timestep of a run (decision plus bookkeeping)."""
+
+    def _prepare_new_simulation(self, output_filename, engine="lp"):
+        super()._prepare_new_simulation(output_filename, engine)
+        self.step_latencies = []
+        self.step_start = time.perf_counter()
+
+    def _record_output_row(self, timestep):
+        super()._record_output_row(timestep)
+        now = time.perf_counter()
+        self.step_latencies.append(now - self.step_start)
+        self.step_start = now
+
+
+def parse_args():
+    """ Parses command line arguments """
+    parser = argparse.ArgumentParser(description='Benchmark decision latency and simulation throughput.')
+    parser.add_argument('--data_path', action='store', default='MOER_data/MOERS.csv', help='Path to dataset.')
+    parser.add_argument('--engine', action='store', default='dp', choices=['lp', 'highs', 'dp'],
+                        help='Decision engine to benchmark, defaults to dp.')
+    parser.add_argument('--slices', nargs='+', default=list(SLICES), choices=list(SLICES),
+                        help='Slices of the dataset to benchmark, defaults to all of them.')
+    parser.add_argument('--output', action='store', default='./output_data/benchmark/benchmark.json',
+                        help='Path of the JSON results file.  Traces and plots go to the same directory.')
+    parser.add_argument('--baseline', action='store', default=None,
+                        help='JSON results of an earlier benchmark to check for regressions against.')
+    parser.add_argument('--tolerance', action='store', type=float, default=0.25,
+                        help='Relative slowdown (or memory growth) beyond which a metric is flagged as a regression, '
+                             'defaults to 0.25.')
+    parser.add_argument('--update_baseline', action='store_true', default=False,
+                        help='Overwrite the baseline file with the new results.')
+    return parser.parse_args()
+
+
+def run_case(data_path, output_dir, engine, slice_name, policy):
+    """
+    Benchmarks one Simulator.run mode on one slice of the dataset.  Meant to be run in a fresh worker process, so
+    that the peak memory measured belongs to this case alone.
+
+    :param data_path: path to the MOER dataset
+    :param output_dir: directory for the case's trace and plot
+    :param engine: the decision engine to use
+    :param slice_name: the slice of the dataset to simulate, a key of SLICES
+    :param policy: the Simulator.run mode, one of POLICIES
+    :return: dict of the case's results
+    """
+    case_dir = os.path.join(output_dir, "{}_{}".format(slice_name, policy))
+    os.makedirs(case_dir, exist_ok=True)
+    initial_historical_data, sim_moer_data = load_moer_data(data_path)
+    timesteps = sim_moer_data.shape[0] if SLICES[slice_name] == "all" else SLICES[slice_name]
+    policy_flags = parse_policy(policy)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        simulator = _TimedSimulator(sim_moer_data, case_dir, timesteps)
+        output_filename = simulator.run(engine=engine, plot=False, **policy_flags)
+        plot_start = time.perf_counter()
+        simulator.visualizer.plot(output_filename)
+        plot_secs = time.perf_counter() - plot_start
+
+    latencies_ms = np.array(simulator.step_latencies) * 1000
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024 if platform.system() == "Darwin" else 1024)
+    return {"slice": slice_name,
+            "policy": policy,
+            "timesteps": simulator.run_summary["timesteps"],
+            "total_lbs_co2": simulator.run_summary["total_lbs_co2"],
+            "run_time_secs": simulator.run_summary["run_time_secs"],
+            "timesteps_per_sec": simulator.run_summary["decisions_per_sec"],
+            "forecast_decisions": simulator.run_summary["forecast_decisions"],
+            "latency_ms": {"mean": latencies_ms.mean(),
+                           "p50": np.percentile(latencies_ms, 50),
+                           "p90": np.percentile(latencies_ms, 90),
+                           "p99": np.percentile(latencies_ms, 99),
+                           "max": latencies_ms.max()},
+            "peak_rss_mb": peak_rss_mb,
+            "plot_secs": plot_secs}
+
+
+def run_benchmark(data_path, output_path, engine="dp", slice_names=tuple(SLICES)):
+    """
+    Benchmarks every Simulator.run mode on every requested slice of the dataset, one case at a time, each in its own
+    process, and writes the results to a JSON file.
+
+    :param data_path: path to the MOER dataset
+    :param output_path: path of the JSON results file
+    :param engine: the decision engine to use
+    :param slice_names: the slices of the dataset to simulate, keys of SLICES
+    :return: the results, as a dict
+    """
+    output_dir = os.path.dirname(output_path) or "."
+    os.makedirs(output_dir, exist_ok=True)
+    cases = {}
+    for slice_name in slice_names:
+        for policy in POLICIES:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                case = pool.submit(run_case, data_path, output_dir, engine, slice_name, policy).result()
+            cases[slice_name + "/" + policy] = case
+            print("{:<28} {:>8.0f} timesteps/sec   latency p50 {:.3f} ms, p99 {:.3f} ms   peak {:.0f} MB   "
+                  "plot {:.2f} sec".format(slice_name + "/" + policy, case["timesteps_per_sec"],
+                                           case["latency_ms"]["p50"], case["latency_ms"]["p99"],
+                                           case["peak_rss_mb"], case["plot_secs"]))
+
+    results = {"created": time.strftime("%Y-%m-%d %H:%M:%S"),
+               "engine": engine,
+               "data_path": data_path,
+               "python": platform.python_version(),
+               "numpy": np.__version__,
+               "machine": platform.platform(),
+               "cases": cases}
+    _write_json(results, output_path)
+    return results
+
+
+def find_regressions(results, baseline, tolerance=0.25):
+    """
+    Compares benchmark results against a baseline.
+
+    :param results: benchmark results, as returned by run_benchmark
+    :param baseline: earlier benchmark results
+    :param tolerance: relative change of a tracked metric, in its worse direction, beyond which it is a regression
+    :return: list of human readable regression descriptions (empty if there are none)
+    """
+    regressions = []
+    if results["engine"] != baseline["engine"]:
+        regressions.append("engine changed: {} -> {}".format(baseline["engine"], results["engine"]))
+    for name, case in results["cases"].items():
+        baseline_case = baseline["cases"].get(name)
+        if baseline_case is None:
+            continue
+        if not np.isclose(case["total_lbs_co2"], baseline_case["total_lbs_co2"], rtol=0, atol=1e-9):
+            regressions.append("{}: total lbs CO2 changed: {} -> {}".format(
+                name, baseline_case["total_lbs_co2"], case["total_lbs_co2"]))
+        for metric, (higher_is_better, noise) in TRACKED_METRICS.items():
+            old, new = _get_metric(baseline_case, metric), _get_metric(case, metric)
+            if old <= 0 or abs(new - old) <= noise:
+                continue
+            change = (old - new) / old if higher_is_better else (new - old) / old
+            if change > tolerance:
+                regressions.append("{}: {} regressed by {:.0%}: {:.4g} -> {:.4g}".format(name, metric, change, old,
+                                                                                        new))
+    return regressions
+
+
+def _get_metric(case, metric):
+    """Looks up a (possibly nested, dot separated) metric of a benchmark case."""
+    value = case
+    for key in metric.split("."):
+        value = value[key]
+    return value
+
+
+def _write_json(results, path):
+    with open(path, 'w') as json_file:
+        json.dump(results, json_file, indent=2, default=float)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    benchmark_results = run_benchmark(args.data_path, args.output, args.engine, args.slices)
+    print("Results written to", args.output)
+
+    exit_code = 0
+    if args.baseline is not None and not args.update_baseline and not os.path.exists(args.baseline):
+        print("\nNo baseline at {} yet, store one with --update_baseline.".format(args.baseline))
+    elif args.baseline is not None and not args.update_baseline:
+        with open(args.baseline) as baseline_file:
+            found = find_regressions(benchmark_results, json.load(baseline_file), args.tolerance)
+        if found:
+            print("\nREGRESSIONS against {}:".format(args.baseline))
+            for regression in found:
+                print("  " + regression)
+            exit_code = 1
+        else:
+            print("\nNo regressions against {} (tolerance {:.0%}).".format(args.baseline, args.tolerance))
+    if args.baseline is not None and args.update_baseline:
+        _write_json(benchmark_results, args.baseline)
+        print("Baseline written to", args.baseline)
+    exit(exit_code)
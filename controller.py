@@ -0,0 +1,338 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+import numpy as np
+from decision_engines import create_engine
+from moer_features import MINS_PER_DAY, RunningHistoricalAverages, compute_timeslot_id, hist_extension_length
+from refrigerator import Refrigerator
+from refrigerator_sim import load_moer_data
+from simulator import Simulator, parse_policy
+
+
+class RealTimeController:
+    """
+    Decides the fridge's on/off status in real time, one timestep per incoming MOER message, with the same policies as
+    Simulator.run.  Messages are dicts with a "timestamp", the timestep's "moer" and optionally a "forecast": the
+    forecast MOERs of the window starting at the timestep (the timestep's own MOER first).  Historical averages are
+    accumulated from the messages as they arrive.
+
+    The decision engine runs in a worker thread, off the event loop, with a deadline per decision.  If it misses the
+    deadline (which includes waiting for the engine to finish an earlier solve that missed its own deadline), the fridge
+    falls back to the thermostat rule for that timestep: keep the current status unless the expected temperature leaves
+    the allowed band.
+    """
+    TRACE_COLUMNS = Simulator.TRACE_COLUMNS + ["decision", "latency_ms"]
+
+    def __init__(self, engine="dp", deadline_ms=100, use_zeroes=True, use_forecast=True, use_hist=True,
+                 lookahead_mins=60, max_hist_extension=6, hist_bucket_mins=5, fridge_params=None, output_path=None,
+                 flush_rows=1000):
+        """
+        :param engine: the decision engine used to optimize the forecast window, see Simulator.run
+        :param deadline_ms: the time the decision engine gets per decision, in milliseconds
+        :param use_zeroes: whether to make default decision to turn on (if possible) in timesteps with a MOER value of 0
+        :param use_forecast: whether to incorporate the forecast window into decision making
+        :param use_hist: whether to extend the forecast window using historical averages as they become available
+        :param lookahead_mins: the length of the forecast window, in minutes
+        :param max_hist_extension: the maximum number of timesteps of historical averages to extend the forecast by
+        :param hist_bucket_mins: the size of the time-of-day buckets historical averages are collected in, in minutes
+        :param fridge_params: optional dict of Refrigerator constant overrides, e.g. {"MAX_TEMP": 45}
+        :param output_path: optional path of a csv file to write the decisions to (Simulator trace columns, plus the
+                            decision path and latency of every timestep)
+        :param flush_rows: the number of decisions buffered before they are appended to the output file
+        """
+        if use_hist and not use_forecast:
+            raise Exception("If historical averages are being used, forecast window must be too.")
+        self.mins_per_timestep = 5  # size of one timestep in minutes
+        self.lookahead_window = int(lookahead_mins / self.mins_per_timestep)
+        self.max_hist_extension = max_hist_extension
+        self.hist_bucket_mins = hist_bucket_mins
+        self.deadline_secs = deadline_ms / 1000
+        self.use_zeroes = use_zeroes
+        self.use_forecast = use_forecast
+        self.use_hist = use_hist
+        self.fridge = Refrigerator(**(fridge_params or {}))
+        self.engine = create_engine(engine, self.fridge, self.mins_per_timestep)
+        self.executor = ThreadPoolExecutor(max_workers=1)  # one solve at a time, the engines aren't thread safe
+        self.late_solve = None  # the concurrent.futures.Future of a solve that missed its deadline
+        self.running_averages = RunningHistoricalAverages(MINS_PER_DAY // hist_bucket_mins,
+                                                          MINS_PER_DAY // self.mins_per_timestep)
+        self.current_time = 0
+        self.total_lbs_co2 = 0
+        self.decisions = {"zero_moer": 0, "forecast": 0, "rule": 0, "fallback": 0}
+        self.deadline_misses = 0
+        self.busy_fallbacks = 0
+        self.latencies = []
+        self.output_path = output_path
+        self.flush_rows = flush_rows
+        self.rows = []
+        self.rows_written = 0
+
+    async def run(self, source):
+        """
+        Makes a decision for every message of a source, until the source ends.
+
+        :param source: async iterable of MOER messages (see replay_moer_data, tail_messages and socket_messages)
+        :return: the controller's stats, see stats
+        """
+        try:
+            await self.warm_up()
+            async for message in source:
+                await self.handle(message)
+        finally:
+            self._write_output()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        return self.stats()
+
+    async def handle(self, message):
+        """
+        Decides the fridge's status for the timestep of a MOER message, and advances the fridge by one timestep.
+
+        :param message: a MOER message dict
+        """
+        received = time.perf_counter()
+        moer = message["moer"]
+        slot = compute_timeslot_id(message["timestamp"], self.hist_bucket_mins)
+        hist_avg, hist_datapoints = self.running_averages.add(slot, moer)
+        # the expected temp if the fridge continues in its current state (on/off) for another timestep
+        expected_temp = self.fridge.expected_temp(self.current_time + self.mins_per_timestep)
+
+        if self.use_zeroes and moer == 0:
+            self.fridge.apply_zero_moer_rule(expected_temp)
+            decision_path = "zero_moer"
+        else:
+            decision = None
+            if self.use_forecast:
+                decision = await self._solve(self._get_window(message, hist_datapoints))
+            if decision is not None:
+                self.fridge.set_status(decision)
+                decision_path = "forecast"
+            else:
+                self.fridge.apply_thermostat_rule(expected_temp)
+                decision_path = "fallback" if self.use_forecast else "rule"
+        latency = time.perf_counter() - received
+        self.decisions[decision_path] += 1
+        self.latencies.append(latency)
+
+        lbs_co2 = self.fridge.lbs_co2_from_moer(moer, self.mins_per_timestep) if self.fridge.on else 0
+        self.total_lbs_co2 += lbs_co2
+        self.rows.append((self.current_time, round(self.fridge.current_temp, 2), self.fridge.on, moer, lbs_co2,
+                          hist_avg, decision_path, latency * 1000))
+        if len(self.rows) >= self.flush_rows:
+            self._write_output()
+
+        self.fridge.current_temp = self.fridge.expected_temp(self.current_time + self.mins_per_timestep)
+        self.current_time += self.mins_per_timestep
+        self.fridge.current_timestamp = self.current_time
+
+    async def warm_up(self):
+        """
+        Runs the decision engine once on a dummy window, without a deadline, so that its one-off startup costs (solver
+        imports, model setup) aren't counted against the deadline of the first decision.
+        """
+        if not self.use_forecast:
+            return
+        engine = self.engine
+        await asyncio.wrap_future(self.executor.submit(engine.decide, np.ones(self.lookahead_window),
+                                                       self.fridge.current_temp))
+        engine.calls, engine.build_secs, engine.solve_secs = 0, 0.0, 0.0
+
+    def stats(self):
+        """
+        :return: dict of the controller's decision counts, fallback rate and decision latency percentiles
+        """
+        latencies_ms = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        optimizer_decisions = self.decisions["forecast"] + self.decisions["fallback"]
+        return {"timesteps": len(self.latencies),
+                "total_lbs_co2": self.total_lbs_co2,
+                "decisions": dict(self.decisions),
+                "deadline_ms": self.deadline_secs * 1000,
+                "deadline_misses": self.deadline_misses,
+                "busy_fallbacks": self.busy_fallbacks,
+                "fallback_rate": self.decisions["fallback"] / optimizer_decisions if optimizer_decisions else 0,
+                "latency_ms": {"mean": latencies_ms.mean(),
+                               "p50": np.percentile(latencies_ms, 50),
+                               "p99": np.percentile(latencies_ms, 99),
+                               "max": latencies_ms.max()}}
+
+    def _get_window(self, message, hist_datapoints):
+        """
+        Builds the forecast window of a message's timestep, extended with historical averages as in
+        Simulator._get_next_decision.
+
+        :param message: a MOER message dict
+        :param hist_datapoints: the number of datapoints in the historical average of the message's timestep
+        :return: numpy array of the window's (forecast or predicted) MOERs
+        """
+        forecast = np.asarray(message.get("forecast", [message["moer"]]))[:self.lookahead_window]
+        hist_extension = np.array([])
+        # a forecast cut short means the data ends within the window, so there is nothing left to extend
+        if self.use_hist and forecast.size == self.lookahead_window:
+            hist_lookahead_window = hist_extension_length(hist_datapoints, self.max_hist_extension)
+            hist_extension = self.running_averages.predict(self.lookahead_window + hist_lookahead_window - 1)[
+                self.lookahead_window - 1:]
+        return np.concatenate((forecast, hist_extension))
+
+    async def _solve(self, window_moers):
+        """
+        Runs the decision engine on a forecast window in the worker thread, with the controller's deadline.
+
+        :param window_moers: numpy array of the window's (forecast or predicted) MOERs
+        :return: the engine's decision (0 or 1), or None if it missed the deadline (including time spent waiting for an
+                 earlier, late solve to finish)
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline_secs
+        # the worker thread's own future: its status is current even if the event loop hasn't run since the late solve
+        # finished (a source that never waits doesn't give the loop a chance to run callbacks)
+        if self.late_solve is not None and not self.late_solve.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.late_solve)), self.deadline_secs)
+            except asyncio.TimeoutError:
+                self.busy_fallbacks += 1
+                return None
+        self.late_solve = None
+        solve = self.executor.submit(self.engine.decide, window_moers, self.fridge.current_temp)
+        result = asyncio.wrap_future(solve)
+        try:
+            return await asyncio.wait_for(asyncio.shield(result), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self.deadline_misses += 1
+            self.late_solve = solve
+            result.add_done_callback(lambda done: done.cancelled() or done.exception())  # the late result is dropped
+            return None
+
+    def _write_output(self):
+        """Appends the buffered decisions to the output file (if there is one)."""
+        if self.output_path is not None and (self.rows or self.rows_written == 0):
+            import pandas as pd  # deferred, only writing the decisions needs pandas
+            output = pd.DataFrame(self.rows, columns=self.TRACE_COLUMNS)
+            first_write = self.rows_written == 0
+            output.to_csv(self.output_path, index=False, mode='w' if first_write else 'a', header=first_write)
+            self.rows_written += len(self.rows)
+        self.rows = []
+
+
+async def replay_moer_data(data_path, speedup=None, lookahead_mins=60, mins_per_timestep=5):
+    """
+    Replays the simulated part of a MOER dataset (see refrigerator_sim.load_moer_data) as MOER messages, with a
+    perfect forecast of the following rows, at an accelerated speed.
+
+    :param data_path: path to the MOER .csv file
+    :param speedup: how many times faster than real time (one timestep per mins_per_timestep minutes) messages are
+                    sent, None to send them as fast as they are consumed
+    :param lookahead_mins: the length of the forecast included in each message, in minutes
+    :param mins_per_timestep: size of one timestep in minutes
+    :return: async generator of MOER messages
+    """
+    initial_historical_data, sim_moer_data = load_moer_data(data_path)
+    timestamps = sim_moer_data["timestamp"].tolist()
+    moers = sim_moer_data["MOER"].tolist()
+    lookahead_window = int(lookahead_mins / mins_per_timestep)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for row, (timestamp, moer) in enumerate(zip(timestamps, moers)):
+        if speedup:
+            # scheduled from the start, so that slow consumers don't stretch the schedule
+            await asyncio.sleep(max(0.0, start + row * mins_per_timestep * 60 / speedup - loop.time()))
+        yield {"timestamp": timestamp, "moer": moer, "forecast": moers[row: row + lookahead_window]}
+
+
+async def tail_messages(path, poll_secs=0.05):
+    """
+    Follows a file of MOER messages, one JSON object per line, as lines are appended to it (like tail -f), until a
+    {"stop": true} message.  A stand-in for a live MOER feed.
+
+    :param path: path of the message file, waited for if it doesn't exist yet
+    :param poll_secs: how long to wait for new lines when the end of the file is reached, in seconds
+    :return: async generator of MOER messages
+    """
+    while not os.path.exists(path):
+        await asyncio.sleep(poll_secs)
+    with open(path) as message_file:
+        line = ""
+        while True:
+            line += message_file.readline()
+            if not line.endswith("\n"):  # nothing new yet, or a partially written line
+                await asyncio.sleep(poll_secs)
+                continue
+            message = json.loads(line)
+            line = ""
+            if message.get("stop"):
+                return
+            yield message
+
+
+async def socket_messages(host="127.0.0.1", port=8765):
+    """
+    Serves a local TCP socket that accepts MOER messages, one JSON object per line, from any number of connections,
+    until a {"stop": true} message.
+
+    :param host: the address to listen on
+    :param port: the port to listen on
+    :return: async generator of MOER messages
+    """
+    messages = asyncio.Queue()
+
+    async def read_messages(reader, writer):
+        async for line in reader:
+            if line.strip():
+                await messages.put(json.loads(line))
+        writer.close()
+
+    server = await asyncio.start_server(read_messages, host, port)
+    try:
+        while True:
+            message = await messages.get()
+            if message.get("stop"):
+                return
+            yield message
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def parse_args():
+    """ Parses command line arguments """
+    parser = argparse.ArgumentParser(description='Run the fridge controller in real time on a live MOER feed.')
+    parser.add_argument('--source', action='store', default='replay', choices=['replay', 'tail', 'socket'],
+                        help='MOER feed: replay the dataset (load test), follow a file of JSON messages, or accept '
+                             'JSON messages on a local socket.  Defaults to replay.')
+    parser.add_argument('--data_path', action='store', default='MOER_data/MOERS.csv',
+                        help='Path to dataset, for --source replay.')
+    parser.add_argument('--speedup', action='store', type=float, default=None,
+                        help='Replay this many times faster than real time (e.g. 3000 for one timestep per 0.1 sec), '
+                             'defaults to as fast as possible.')
+    parser.add_argument('--path', action='store', default=None, help='Message file to follow, for --source tail.')
+    parser.add_argument('--port', action='store', type=int, default=8765,
+                        help='Local port to listen on, for --source socket, defaults to 8765.')
+    parser.add_argument('--policy', action='store', default='zeroes_forecast_hist',
+                        help='Policy, as named in simulation outputs: no_data, zeroes, zeroes_forecast, '
+                             'zeroes_forecast_hist (default), forecast, forecast_hist.')
+    parser.add_argument('--engine', action='store', default='dp', choices=['lp', 'highs', 'dp'],
+                        help='Decision engine for the forecast window, defaults to dp.')
+    parser.add_argument('--deadline_ms', action='store', type=float, default=100,
+                        help='Time the decision engine gets per decision before falling back to the thermostat rule, '
+                             'in milliseconds, defaults to 100.')
+    parser.add_argument('--output', action='store', default='./output_data/controller_decisions.csv',
+                        help='Path of the csv file the decisions are written to.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    policy_flags = parse_policy(args.policy)
+    controller = RealTimeController(args.engine, args.deadline_ms, output_path=args.output, **policy_flags)
+    if args.source == 'replay':
+        moer_source = replay_moer_data(args.data_path, args.speedup)
+    elif args.source == 'tail':
+        moer_source = tail_messages(args.path)
+    else:
+        moer_source = socket_messages(port=args.port)
+    print("Running controller ({}, {} engine, {} ms deadline)...".format(args.policy, args.engine, args.deadline_ms))
+    controller_stats = asyncio.run(controller.run(moer_source))
+    print(json.dumps(controller_stats, indent=2, default=float))
+    print("Decisions written to", args.output)
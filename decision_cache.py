@@ -0,0 +1,98 @@
+from collections import OrderedDict
+import os
+import pickle
+
+
+class DecisionCache:
+    """
+    A bounded, least-recently-used cache of forecast-window decisions.
+
+    Many timesteps pose exactly the same optimization problem: the MOER data is full of repeated values (long runs of
+    zeros, plateaus, daily patterns) and the fridge temperature only ever moves along a fixed lattice.  Keying the
+    decision on the (quantized) starting temperature and the MOER values of the window lets the simulator skip the
+    decision engine entirely for repeated problems.
+    """
+    TEMP_DECIMALS = 4  # temperatures are rounded to this many decimals, absorbs floating point drift
+
+    def __init__(self, max_size=100000, path=None):
+        """
+        :param max_size: the maximum number of decisions held, least recently used decisions are evicted beyond this
+        :param path: optional path of a file to load cached decisions from, and save them to with save()
+        """
+        self.max_size = max_size
+        self.path = path
+        self.problem = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def set_problem(self, problem):
+        """
+        Declares the problem the cached decisions belong to (decision engine, fridge constants, timestep size).
+        Decisions cached for a different problem are discarded.
+
+        :param problem: a hashable description of everything besides the cache key that determines a decision
+        """
+        if problem != self.problem:
+            self.entries.clear()
+            self.problem = problem
+
+    def make_key(self, current_temp, forecast, extension):
+        """
+        :param current_temp: the temperature of the fridge at the start of the forecast window
+        :param forecast: numpy array of the forecast MOERs in the window
+        :param extension: numpy array of the historical average MOERs extending the window (may be empty)
+        :return: the cache key for the decision
+        """
+        return round(current_temp, self.TEMP_DECIMALS), tuple(forecast.tolist()), tuple(extension.tolist())
+
+    def get(self, key):
+        """
+        :param key: a key created by make_key
+        :return: the cached decision, or None if there is none
+        """
+        decision = self.entries.get(key)
+        if decision is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return decision
+
+    def put(self, key, decision):
+        """
+        Caches a decision, evicting the least recently used decision if the cache is full.
+
+        :param key: a key created by make_key
+        :param decision: the decision (0 or 1) made for this key
+        """
+        self.entries[key] = decision
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def save(self):
+        """Writes the cached decisions to the cache file, if one was given."""
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as cache_file:
+            pickle.dump({"problem": self.problem, "entries": self.entries}, cache_file)
+        os.replace(tmp_path, self.path)  # never leave a half-written cache behind
+
+    def _load(self):
+        with open(self.path, 'rb') as cache_file:
+            saved = pickle.load(cache_file)
+        self.problem = saved["problem"]
+        self.entries = saved["entries"]
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
@@ -0,0 +1,428 @@
+import time
+import numpy as np
+
+
+class LpDecisionEngine:
+    """
+    Decides the fridge's next on/off status by formulating the forecast window as a mixed-integer linear program
+    and solving it with PuLP's bundled CBC solver.
+    """
+    name = "lp"
+
+    def __init__(self, fridge, mins_per_timestep):
+        """
+        :param fridge: the Refrigerator whose constants (temperature band, heating/cooling rates) define the problem
+        :param mins_per_timestep: size of one timestep in minutes
+        """
+        self.fridge = fridge
+        self.mins_per_timestep = mins_per_timestep
+        self.calls = 0
+        self.build_secs = 0.0  # total time spent formulating models
+        self.solve_secs = 0.0  # total time spent in the solver
+
+    def decide(self, moer_vector, current_temp, step_sizes=None):
+        """
+        Solves for the CO2-minimizing on/off schedule over the forecast window and returns its first step.
+
+        :param moer_vector: numpy array of (forecast or predicted) MOERs, one per step of the window
+        :param current_temp: the temperature of the fridge at the start of the window
+        :param step_sizes: optional numpy integer array with the number of timesteps of each step (moer_vector holds
+                           the step's average MOER), defaults to 1; see first_decisions
+        :return: 0 if the refrigerator should be off, 1 if the refrigerator should be on
+        """
+        import pulp  # deferred, so that runs that never solve an LP don't pay for importing PuLP
+        build_start = time.perf_counter()
+        model = pulp.LpProblem("CO2_Minimization_Problem", pulp.LpMinimize)
+
+        variable_suffixes = [str(i) for i in range(moer_vector.size)]
+        # s for status (on/off)
+        decision_variables = pulp.LpVariable.matrix("s", variable_suffixes, cat="Binary")
+        if step_sizes is None:
+            step_sizes = np.ones(moer_vector.size, dtype=np.int64)
+        else:
+            # the status of a multi-timestep step is the number of its timesteps spent on
+            for variable, step_size in zip(decision_variables, step_sizes):
+                variable.upBound = int(step_size)
+        status_vector = np.array(decision_variables)
+
+        # Set up objective function
+        obj_func = pulp.lpSum(status_vector * moer_vector)
+        model += obj_func
+
+        # Set up constraints
+        temp_variables = pulp.LpVariable.matrix("t", variable_suffixes, cat="Continuous")
+        for i in range(moer_vector.size - 1):
+            model += temp_variables[i + 1] == temp_variables[i] + \
+                     self.fridge.COOLING_RATE * self.mins_per_timestep * status_vector[i] + \
+                     self.fridge.WARMING_RATE * self.mins_per_timestep * (int(step_sizes[i]) - status_vector[i])
+            model += temp_variables[i + 1] <= self.fridge.MAX_TEMP
+            model += temp_variables[i + 1] >= self.fridge.MIN_TEMP
+        model += temp_variables[0] == current_temp  # starting temp of fridge
+
+        solve_start = time.perf_counter()
+        # CBC's integer preprocessing occasionally fixes a status wrongly on these small models (suboptimal decisions
+        # in about 1 in 200 random windows), so it is left to branch-and-bound alone
+        model.solve(pulp.PULP_CBC_CMD(msg=False, options=["preprocess off"]))
+        self.calls += 1
+        self.build_secs += solve_start - build_start
+        self.solve_secs += time.perf_counter() - solve_start
+
+        # CBC's values are only integral to within its tolerance (an "off" status may come back as -2.6e-12), and a
+        # single-step window at zero MOER leaves the status out of the model (it is free and costless): any will do
+        return int(round(decision_variables[0].value() or 0) > 0)
+
+
+class DpDecisionEngine:
+    """
+    Decides the fridge's next on/off status by solving the same forecast-window problem as LpDecisionEngine exactly,
+    with backward dynamic programming over the lattice of reachable fridge temperatures (see first_decisions).
+    """
+    name = "dp"
+
+    def __init__(self, fridge, mins_per_timestep):
+        """
+        :param fridge: the Refrigerator whose constants (temperature band, heating/cooling rates) define the problem
+        :param mins_per_timestep: size of one timestep in minutes
+        """
+        self.fridge = fridge
+        self.mins_per_timestep = mins_per_timestep
+        self.calls = 0
+        self.build_secs = 0.0  # there is no model to build, the dynamic program is all solve time
+        self.solve_secs = 0.0
+
+    def decide(self, moer_vector, current_temp, step_sizes=None):
+        """
+        Finds the CO2-minimizing on/off schedule over the forecast window and returns its first step.
+
+        :param moer_vector: numpy array of (forecast or predicted) MOERs, one per step of the window
+        :param current_temp: the temperature of the fridge at the start of the window
+        :param step_sizes: optional numpy integer array with the number of timesteps of each step (moer_vector holds
+                           the step's average MOER), defaults to 1; see first_decisions
+        :return: 0 if the refrigerator should be off, 1 if the refrigerator should be on
+        """
+        solve_start = time.perf_counter()
+        decisions = first_decisions(moer_vector, current_temp,
+                                    self.fridge.WARMING_RATE * self.mins_per_timestep,
+                                    self.fridge.COOLING_RATE * self.mins_per_timestep,
+                                    self.fridge.MIN_TEMP, self.fridge.MAX_TEMP, step_sizes)
+        self.calls += 1
+        self.solve_secs += time.perf_counter() - solve_start
+        return int(decisions[0])
+
+
+class HighsDecisionEngine:
+    """
+    Decides the fridge's next on/off status by solving the same mixed-integer program as LpDecisionEngine, but with a
+    persistent, in-process HiGHS model instead of a fresh CBC subprocess per timestep.
+
+    The model is built once, sized for the longest window seen so far.  At each timestep only the objective
+    coefficients (the sliding MOER window), the fixed initial temperature and, when the window length changes, the
+    temperature bounds of the trailing unused variables are updated.  The previous solution, shifted forward by one
+    timestep, is offered to the solver as a warm start.
+    """
+    name = "highs"
+
+    def __init__(self, fridge, mins_per_timestep):
+        """
+        :param fridge: the Refrigerator whose constants (temperature band, heating/cooling rates) define the problem
+        :param mins_per_timestep: size of one timestep in minutes
+        """
+        try:
+            import highspy
+        except ImportError:
+            raise Exception("The 'highs' decision engine requires the highspy package (pip install highspy).")
+        self.highspy = highspy
+        self.fridge = fridge
+        self.mins_per_timestep = mins_per_timestep
+        self.model = None
+        self.capacity = 0  # number of timesteps the current model can hold
+        self.window = 0  # number of timesteps of the model in use for the current window
+        self.step_sizes = None  # number of timesteps of each step of the model's transition rows
+        self.previous_statuses = None
+        self.calls = 0
+        self.build_secs = 0.0  # total time spent building and updating the model
+        self.solve_secs = 0.0  # total time spent in the solver
+
+    def decide(self, moer_vector, current_temp, step_sizes=None):
+        """
+        Solves for the CO2-minimizing on/off schedule over the forecast window and returns its first step.
+
+        :param moer_vector: numpy array of (forecast or predicted) MOERs, one per step of the window
+        :param current_temp: the temperature of the fridge at the start of the window
+        :param step_sizes: optional numpy integer array with the number of timesteps of each step (moer_vector holds
+                           the step's average MOER), defaults to 1; see first_decisions
+        :return: 0 if the refrigerator should be off, 1 if the refrigerator should be on
+        """
+        build_start = time.perf_counter()
+        window = moer_vector.size
+        if window > self.capacity:
+            self._build_model(window)
+        self._set_window_length(window)
+        if step_sizes is None:
+            step_sizes = np.ones(window, dtype=np.int64)
+        self._set_step_sizes(step_sizes)
+
+        # columns 0..capacity-1 are the statuses s_i, columns capacity..2*capacity-1 are the temperatures t_i
+        costs = np.zeros(self.capacity)
+        costs[:window] = moer_vector
+        status_columns = np.arange(self.capacity, dtype=np.int32)
+        self.model.changeColsCost(self.capacity, status_columns, costs)
+        self.model.changeColBounds(self.capacity, current_temp, current_temp)  # starting temp of fridge
+
+        if self.previous_statuses is not None:
+            # warm start: the rest of the last plan is usually still a good (often optimal) plan
+            warm_start = np.append(self.previous_statuses[1:], 0.0)
+            self.model.setSolution(self.capacity, status_columns, warm_start)
+
+        solve_start = time.perf_counter()
+        self.model.run()
+        self.calls += 1
+        self.build_secs += solve_start - build_start
+        self.solve_secs += time.perf_counter() - solve_start
+        if self.model.getModelStatus() != self.highspy.HighsModelStatus.kOptimal:
+            # no schedule keeps the fridge in band (it has already left it), so head back towards the band
+            self.previous_statuses = None
+            return 1 if current_temp > self.fridge.MAX_TEMP else 0
+
+        self.previous_statuses = np.round(np.array(self.model.getSolution().col_value[:self.capacity]))
+        return int(self.previous_statuses[0] > 0)
+
+    def _build_model(self, capacity):
+        """
+        (Re)builds the persistent model with room for a forecast window of the given number of timesteps:
+            t_i+1 - t_i - (cooling_step - warming_step) * s_i == warming_step    for all i < capacity - 1
+
+        :param capacity: the number of timesteps the model should hold
+        """
+        warming_step = self.fridge.WARMING_RATE * self.mins_per_timestep
+        cooling_step = self.fridge.COOLING_RATE * self.mins_per_timestep
+
+        self.model = self.highspy.Highs()
+        self.model.setOptionValue("output_flag", False)
+        # the windows are tiny, so presolve and primal heuristics cost more than they save on every re-solve
+        self.model.setOptionValue("presolve", "off")
+        self.model.setOptionValue("mip_heuristic_effort", 0.0)
+        self.capacity = capacity
+        self.window = capacity
+
+        # status columns (binary) followed by temperature columns (continuous, bounded by the valid temp band)
+        self.model.addCols(capacity, np.zeros(capacity), np.zeros(capacity), np.ones(capacity),
+                           0, np.array([], dtype=np.int32), np.array([], dtype=np.int32), np.array([]))
+        self.model.addCols(capacity, np.zeros(capacity), np.full(capacity, float(self.fridge.MIN_TEMP)),
+                           np.full(capacity, float(self.fridge.MAX_TEMP)),
+                           0, np.array([], dtype=np.int32), np.array([], dtype=np.int32), np.array([]))
+        self.model.changeColsIntegrality(capacity, np.arange(capacity, dtype=np.int32),
+                                         np.full(capacity, self.highspy.HighsVarType.kInteger))
+
+        # one temperature transition row per consecutive pair of timesteps
+        num_rows = capacity - 1
+        if num_rows > 0:
+            rows = np.arange(num_rows)
+            starts = (3 * rows).astype(np.int32)
+            indices = np.column_stack((capacity + rows + 1, capacity + rows, rows)).ravel().astype(np.int32)
+            values = np.tile([1.0, -1.0, -(cooling_step - warming_step)], num_rows)
+            bounds = np.full(num_rows, warming_step)
+            self.model.addRows(num_rows, bounds, bounds, indices.size, starts, indices, values)
+        self.step_sizes = np.ones(capacity, dtype=np.int64)
+        self.previous_statuses = None
+
+    def _set_step_sizes(self, step_sizes):
+        """
+        Updates the steps whose number of timesteps changed: the status s_i of a step counts its timesteps spent on,
+        so its upper bound is the step size, and its temperature transition row becomes
+            t_i+1 - t_i - (cooling_step - warming_step) * s_i == step_size_i * warming_step
+
+        :param step_sizes: numpy integer array with the number of timesteps of each step in the current window
+        """
+        warming_step = self.fridge.WARMING_RATE * self.mins_per_timestep
+        new_sizes = self.step_sizes.copy()
+        new_sizes[:step_sizes.size] = step_sizes
+        for step in np.flatnonzero(new_sizes != self.step_sizes):
+            self.model.changeColBounds(int(step), 0, float(new_sizes[step]))
+            if step < self.capacity - 1:
+                bound = float(new_sizes[step]) * warming_step
+                self.model.changeRowBounds(int(step), bound, bound)
+        self.step_sizes = new_sizes
+
+    def _set_window_length(self, window):
+        """
+        Releases the temperature bounds of timesteps beyond the current window, so that unused trailing variables
+        have no effect on the solution (their statuses also carry a cost of 0).
+
+        :param window: the number of timesteps in the current forecast window
+        """
+        if window == self.window:
+            return
+        inf = self.highspy.kHighsInf
+        temp_columns = np.arange(self.capacity, 2 * self.capacity, dtype=np.int32)
+        lower = np.full(self.capacity, float(self.fridge.MIN_TEMP))
+        upper = np.full(self.capacity, float(self.fridge.MAX_TEMP))
+        lower[window:] = -inf
+        upper[window:] = inf
+        # the initial temperature (column 0) is fixed separately for every window, leave it out here
+        self.model.changeColsBounds(self.capacity - 1, temp_columns[1:], lower[1:], upper[1:])
+        self.window = window
+
+
+ENGINES = {engine.name: engine for engine in (LpDecisionEngine, DpDecisionEngine, HighsDecisionEngine)}
+
+
+def create_engine(name, fridge, mins_per_timestep):
+    """
+    Creates the decision engine registered under the given name.
+
+    :param name: the name of the engine, one of the keys of ENGINES
+    :param fridge: the Refrigerator the engine makes decisions for
+    :param mins_per_timestep: size of one timestep in minutes
+    :return: a new decision engine instance
+    """
+    if name not in ENGINES:
+        raise Exception("Unknown decision engine '{}', expected one of: {}".format(name, ", ".join(ENGINES)))
+    return ENGINES[name](fridge, mins_per_timestep)
+
+
+DP_TOLERANCE = 1e-6  # slack on the temperature band, absorbs floating point drift in the simulated temperature
+
+
+def first_decisions(moer_vector, current_temps, warming_steps, cooling_steps, min_temps, max_temps, step_sizes=None):
+    """
+    Finds the CO2-minimizing on/off schedule over a forecast window for one or many fridges at once, and returns the
+    first step of each fridge's schedule.  This solves exactly the problem LpDecisionEngine solves, with backward
+    dynamic programming instead of branch-and-bound.
+
+    Because a fridge only ever warms or cools by a fixed amount per timestep, its temperature after n timesteps is
+    determined entirely by the number b of those timesteps it spent on:
+        temp(n, b) = current_temp + n * warming_step - b * (warming_step - cooling_step)
+    so the reachable temperatures form a lattice, and only the few values of b that keep temp(n, b) inside the valid
+    band (an interval of b, at most (max - min) / (warming_step - cooling_step) + 1 wide) need to be tracked per
+    step.  Fridges are processed side by side as rows of the DP arrays; they may all differ in starting temperature,
+    band and rates, but share the MOER window.
+
+    A step of the window may span several timesteps (see step_sizes), of which the fridge may spend any number on.
+    The band is only checked at the end of such a step, so coarse steps plan a duty cycle rather than an exact
+    schedule: a slight relaxation of the problem over the same timesteps, at a fraction of the cost.
+
+    :param moer_vector: numpy array of (forecast or predicted) MOERs, one per step of the window (the average MOER of
+                        the step's timesteps)
+    :param current_temps: temperature of each fridge at the start of the window (scalar or numpy array)
+    :param warming_steps: temperature change of each fridge over one timestep spent off (scalar or numpy array)
+    :param cooling_steps: temperature change of each fridge over one timestep spent on (scalar or numpy array)
+    :param min_temps: minimum valid temperature of each fridge (scalar or numpy array)
+    :param max_temps: maximum valid temperature of each fridge (scalar or numpy array)
+    :param step_sizes: optional numpy integer array with the number of timesteps of each step, defaults to all 1
+    :return: numpy integer array with one decision per fridge: 0 if it should be off, 1 if it should be on
+    """
+    current_temps, warming_steps, cooling_steps, min_temps, max_temps = np.broadcast_arrays(
+        *[np.atleast_1d(np.asarray(values, dtype=float))
+          for values in (current_temps, warming_steps, cooling_steps, min_temps, max_temps)])
+    window = moer_vector.size
+    if window == 1:
+        # no constrained temperatures in the window, only the cost of this step matters
+        return np.full(current_temps.size, 0 if moer_vector[0] > 0 else 1)
+
+    if step_sizes is None:
+        step_sizes = np.ones(window, dtype=np.int64)
+    drop = warming_steps - cooling_steps  # temperature difference between an on and an off timestep
+
+    # lowest[i, f]: lowest feasible b for fridge f after i steps, num_feasible[i, f]: number of feasible values of b
+    elapsed = np.concatenate(([0], np.cumsum(step_sizes[:-1])))[:, np.newaxis]  # timesteps before each step
+    lowest = np.maximum(0, np.ceil((current_temps + elapsed * warming_steps - max_temps - DP_TOLERANCE) / drop))
+    highest = np.minimum(elapsed, np.floor((current_temps + elapsed * warming_steps - min_temps + DP_TOLERANCE) / drop))
+    lowest, num_feasible = lowest.astype(np.int64), (highest - lowest + 1).astype(np.int64)
+
+    # min_cost[f, pad + k]: cheapest cost of the remaining window for fridge f, given lowest[i, f] + k on-timesteps so
+    # far, padded with infeasible (infinite cost) entries on each side.  The final step's status has no effect on any
+    # constrained temperature, so it is free to be off.
+    width = min(int(elapsed[-1, 0]) + 1, int(np.max(np.floor((max_temps - min_temps) / drop + DP_TOLERANCE))) + 1)
+    pad = int(np.max(step_sizes))
+    feasible = np.arange(width) < num_feasible[:, :, np.newaxis]
+    # from one step to the next, the lowest feasible b rises by 0 .. step size (the rise per timestep is
+    # warming_step / drop < 1); for single-timestep steps, b = lowest[i] + k is the k-th or the (k-1)-th feasible b of
+    # step i + 1
+    rises = lowest[1:] - lowest[:-1]
+    unshifted = (rises == 0)[:, :, np.newaxis]
+    columns = pad + np.arange(width) - rises[:, :, np.newaxis]  # column of b = lowest[i] + k in step i + 1
+    min_cost = np.full((current_temps.size, width + 2 * pad), np.inf)
+    all_columns = np.arange(width + 2 * pad)
+    fridges = np.arange(current_temps.size)
+    min_cost[:, pad:pad + width][feasible[window - 1]] = 0.0
+
+    for i in range(window - 2, 0, -1):
+        if step_sizes[i] == 1:
+            # best[:, 1 + j]: cheapest cost from step i on, given lowest[i + 1] + j on-steps before it (j = -1..width-1)
+            best = np.minimum(min_cost[:, pad - 1:pad + width], moer_vector[i] + min_cost[:, pad:pad + width + 1])
+            costs = np.where(unshifted[i], best[:, 1:], best[:, :width])
+        else:
+            # on for 0 .. step size timesteps: the cheapest of a run of consecutive columns, once the cost of the
+            # on-timesteps is folded into the columns as a ramp
+            ramped = min_cost + moer_vector[i] * all_columns
+            run_min = ramped.copy()
+            for on_steps in range(1, step_sizes[i] + 1):
+                np.minimum(run_min[:, :-on_steps], ramped[:, on_steps:], out=run_min[:, :-on_steps])
+            costs = run_min[fridges[:, np.newaxis], columns[i]] - moer_vector[i] * columns[i]
+        min_cost[:, pad:pad + width] = np.where(feasible[i], costs, np.inf)
+
+    # the starting temperature is not constrained, b = 0 (off) or b > 0 (on) after the first step
+    cost_off = min_cost[fridges, np.clip(pad - lowest[1], 0, width + 2 * pad - 1)]
+    cost_on = np.full(current_temps.size, np.inf)
+    for on_steps in range(1, step_sizes[0] + 1):
+        cost_on = np.minimum(cost_on, on_steps * moer_vector[0] +
+                             min_cost[fridges, np.clip(pad + on_steps - lowest[1], 0, width + 2 * pad - 1)])
+    decisions = (cost_on < cost_off).astype(np.int64)
+    # where no schedule keeps the fridge in band (it has already left it), head back towards the band
+    stranded = np.isinf(cost_off) & np.isinf(cost_on)
+    decisions[stranded] = current_temps[stranded] > max_temps[stranded]
+    return decisions
+
+
+def optimal_schedule(step_costs, initial_temp, warming_step, cooling_step, min_temp, max_temp):
+    """
+    Finds the cheapest on/off schedule of a fridge over a whole simulation with perfect knowledge of every timestep's
+    cost (the offline optimum, a lower bound for any policy that keeps the fridge in its band).  This is the forecast
+    window problem of first_decisions stretched over the full horizon, with the same temperature lattice, but the
+    whole schedule is recovered instead of its first step.
+
+    The temperature at the start of every timestep but the first must be inside the band; the temperature after the
+    last timestep is unconstrained, as in a forecast window.
+
+    :param step_costs: numpy array of the cost (e.g. lbs CO2) of spending each timestep on
+    :param initial_temp: the temperature of the fridge at the start of the first timestep
+    :param warming_step: temperature change over one timestep spent off
+    :param cooling_step: temperature change over one timestep spent on
+    :param min_temp: minimum valid temperature
+    :param max_temp: maximum valid temperature
+    :return: (schedule, cost): numpy boolean array with the status of every timestep, and the schedule's total cost
+    """
+    num_steps = step_costs.size
+    drop = warming_step - cooling_step
+    # feasible numbers b of on-timesteps before each timestep: lowest[t] .. lowest[t] + num_feasible[t] - 1
+    elapsed = np.arange(num_steps + 1)
+    lowest = np.maximum(0, np.ceil((initial_temp + elapsed * warming_step - max_temp - DP_TOLERANCE) / drop))
+    highest = np.minimum(elapsed, np.floor((initial_temp + elapsed * warming_step - min_temp + DP_TOLERANCE) / drop))
+    lowest[0], highest[0] = 0, 0  # the starting temperature is not constrained
+    lowest[-1], highest[-1] = 0, num_steps  # neither is the final one
+    lowest, num_feasible = lowest.astype(np.int64).tolist(), (highest - lowest + 1).astype(np.int64).tolist()
+    if min(num_feasible) <= 0:
+        raise Exception("No schedule keeps the fridge within its temperature band.")
+
+    # cost_to_go[k]: cheapest cost of the remaining timesteps, given lowest[t] + k on-timesteps before timestep t
+    cost_to_go = np.zeros(num_feasible[-1])
+    turn_on = [None] * num_steps
+    for t in range(num_steps - 1, -1, -1):
+        # b = lowest[t] + k stays at b (off) or moves to b + 1 (on), index k + shift in the next timestep's array
+        shift = lowest[t] - lowest[t + 1]
+        next_costs = np.concatenate(([np.inf], cost_to_go, [np.inf]))  # padded, out of band is infinitely costly
+        indices = np.arange(num_feasible[t]) + shift + 1
+        cost_off = next_costs[np.clip(indices, 0, next_costs.size - 1)]
+        cost_on = step_costs[t] + next_costs[np.clip(indices + 1, 0, next_costs.size - 1)]
+        turn_on[t] = cost_on < cost_off
+        cost_to_go = np.where(turn_on[t], cost_on, cost_off)
+    if np.isinf(cost_to_go[0]):
+        raise Exception("No schedule keeps the fridge within its temperature band.")
+
+    schedule = np.zeros(num_steps, dtype=bool)
+    on_steps = 0
+    for t in range(num_steps):
+        schedule[t] = turn_on[t][on_steps - lowest[t]]
+        on_steps += schedule[t]
+    return schedule, float(cost_to_go[0])
@@ -0,0 +1,241 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import itertools
+import os
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from feature_cache import MoerFeatures, load_moer_features
+from refrigerator_sim import load_moer_data
+from simulator import Simulator, parse_policy
+
+# MoerFeatures arrays placed in shared memory, so that every worker reads the same (read-only) copy of the dataset
+SHARED_ARRAYS = ["moers", "timeslot_ids", "hist_avgs", "hist_datapoints"]
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# Shared memory blocks and MoerFeatures of the current worker process, attached once per worker by _attach_worker_data
+_worker_data = {}
+
+
+class NoisyForecastSimulator(Simulator):
+    """
+    A Simulator whose forecasts are wrong: every forecast window is the actual MOERs with seeded, multiplicative
+    gaussian noise whose standard deviation grows with lead time (the square root of the lead, as a fraction of the
+    window), up to noise_level at the end of the window.  The current timestep's MOER (lead 0) is known exactly, and
+    emissions are always counted with the actual MOERs.
+    """
+
+    def __init__(self, noise_level, seed, *args, name="noisy", keep_trace=False, **kwargs):
+        """
+        :param noise_level: the standard deviation of the relative forecast error at the end of the forecast window,
+                            e.g. 0.1 for 10%
+        :param seed: the seed of the noise, an int or a sequence of ints (see numpy.random.default_rng)
+        :param name: the name of the replica, used in the output filename (sim_output_<name>.<trace_format>)
+        :param keep_trace: whether to write the output trace, or only keep the run's totals
+        :param args: the Simulator's arguments
+        :param kwargs: the Simulator's keyword arguments
+        """
+        super().__init__(*args, **kwargs)
+        self.noise_level = noise_level
+        self.rng = np.random.default_rng(seed)
+        self.name = name
+        self.keep_trace = keep_trace
+        self.lead_scale = np.sqrt(np.arange(self.lookahead_window) / max(self.lookahead_window - 1, 1))
+
+    def _get_output_filename(self, use_zeroes, use_forecast, use_hist):
+        return self.output_dir.rstrip("/") + "/" + "sim_output_" + self.name + "." + self.trace_format
+
+    def _get_forecast(self, start_timestep):
+        forecast = super()._get_forecast(start_timestep)
+        if self.noise_level == 0:
+            return forecast
+        errors = self.rng.standard_normal(len(forecast)) * self.noise_level * self.lead_scale[:len(forecast)]
+        return np.maximum(forecast * (1 + errors), 0)
+
+    def _write_output(self, output_filename):
+        if self.keep_trace:
+            return super()._write_output(output_filename)
+        self.trace_rows_written += self.trace_length
+        self.trace_length = 0
+        return
+
+
+def share_features(features):
+    """
+    Copies the arrays of MoerFeatures into shared memory blocks, to be attached to by worker processes without copying
+    (see attach_features).  The caller owns the blocks: close and unlink them when the workers are done.
+
+    :param features: MoerFeatures of the simulated data
+    :return: (blocks, spec): the list of SharedMemory blocks, and a (picklable) dict describing them to attach_features
+    """
+    blocks = []
+    spec = {"hist_bucket_mins": features.hist_bucket_mins, "seeded": features.seeded, "arrays": {}}
+    for name in SHARED_ARRAYS:
+        array = np.ascontiguousarray(getattr(features, name))
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        blocks.append(block)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        spec["arrays"][name] = (block.name, array.shape, array.dtype.str)
+    return blocks, spec
+
+
+def attach_features(spec):
+    """
+    :param spec: the spec of shared MoerFeatures, as returned by share_features
+    :return: (blocks, features): the attached SharedMemory blocks (which must be kept open while the features are in
+             use), and MoerFeatures whose arrays are read-only views of the blocks
+    """
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in spec["arrays"].items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        arrays[name].flags.writeable = False
+    return blocks, MoerFeatures(hist_bucket_mins=spec["hist_bucket_mins"], seeded=spec["seeded"], **arrays)
+
+
+def run_replica(noise_level, replica, settings):
+    """
+    Runs a single replica of the ensemble on the worker's shared MOER data.  Meant to be run in a worker process.
+
+    :param noise_level: the replica's forecast noise level (see NoisyForecastSimulator)
+    :param replica: the index of the replica within its noise level
+    :param settings: dict of the ensemble's settings: policy, engine, lookahead_mins, timesteps, seed, output_dir and
+                     keep_traces
+    :return: a result row (dict) for the replica
+    """
+    features = _worker_data["features"]
+    timesteps = len(features) if settings["timesteps"] == "all" else int(settings["timesteps"])
+    policy_flags = parse_policy(settings["policy"])
+    # the noise of every replica is independent of the others and of the number of workers
+    seed = [settings["seed"], int(round(noise_level * 1e6)), replica]
+    name = "noise_{}_replica_{:04d}".format(noise_level, replica)
+
+    with contextlib.redirect_stdout(io.StringIO()):  # keep the workers' progress messages out of the ensemble output
+        simulator = NoisyForecastSimulator(noise_level, seed, features, settings["output_dir"], timesteps,
+                                           lookahead_mins=settings["lookahead_mins"], name=name,
+                                           keep_trace=settings["keep_traces"], trace_format="npy")
+        simulator.run(engine=settings["engine"], plot=False, **policy_flags)
+
+    return {"noise_level": noise_level, "replica": replica, "total_lbs_co2": simulator.total_lbs_co2,
+            "forecast_decisions": simulator.forecast_decisions, "run_time_secs": simulator.run_summary["run_time_secs"]}
+
+
+def summarize_replicas(replicas):
+    """
+    :param replicas: pandas dataframe of replica result rows (see run_replica)
+    :return: pandas dataframe with the distribution of total lbs CO2 per noise level: mean, standard deviation,
+             min, PERCENTILES and max, and the mean's increase over the perfect forecast (noise level 0)
+    """
+    import pandas as pd  # deferred, so that loading this module (e.g. in a worker) doesn't import pandas
+    grouped = replicas.groupby("noise_level")["total_lbs_co2"]
+    summary = pd.DataFrame({"replicas": grouped.size(), "mean": grouped.mean(), "std": grouped.std().fillna(0),
+                            "min": grouped.min()})
+    for percentile in PERCENTILES:
+        summary["p{}".format(percentile)] = grouped.quantile(percentile / 100)
+    summary["max"] = grouped.max()
+    perfect = summary.loc[0, "mean"]
+    summary["mean_vs_perfect_pct"] = 100 * (summary["mean"] - perfect) / perfect
+    return summary.reset_index()
+
+
+def run_ensemble(features, noise_levels, replicas, output_dir, workers=None, policy="zeroes_forecast_hist",
+                 engine="dp", lookahead_mins=60, timesteps="all", seed=0, keep_traces=False):
+    """
+    Runs replicas of a policy with noisy forecasts at every noise level across a pool of worker processes, and writes
+    every replica's result (ensemble_replicas.csv) and their distribution per noise level (ensemble_summary.csv) to
+    the output directory.  The workers share one read-only copy of the MOER data, in shared memory.  The perfect
+    forecast (noise level 0) is deterministic, so it is always run, once, as the reference.
+
+    :param features: MoerFeatures of the simulated data (see feature_cache.MoerFeatures.compute)
+    :param noise_levels: list of forecast noise levels (see NoisyForecastSimulator)
+    :param replicas: the number of replicas per (non zero) noise level
+    :param output_dir: directory for the result tables (and the replicas' traces)
+    :param workers: number of worker processes, defaults to the number of cores
+    :param policy: the policy of every replica, e.g. "zeroes_forecast_hist" (must use the forecast)
+    :param engine: the decision engine of every replica
+    :param lookahead_mins: the length of the forecast window, in minutes
+    :param timesteps: the number of timesteps of every replica, or "all"
+    :param seed: the base seed of the noise
+    :param keep_traces: whether to write every replica's trace (.npy)
+    :return: the summary table, as a pandas dataframe
+    """
+    if not parse_policy(policy)["use_forecast"]:
+        raise Exception("Forecast noise only affects policies that use the forecast, not '{}'.".format(policy))
+    noise_levels = sorted(set([0.0] + [float(noise_level) for noise_level in noise_levels]))
+    jobs = [(noise_level, replica) for noise_level in noise_levels
+            for replica in range(replicas if noise_level != 0 else 1)]
+    settings = {"policy": policy, "engine": engine, "lookahead_mins": lookahead_mins, "timesteps": timesteps,
+                "seed": seed, "output_dir": output_dir, "keep_traces": keep_traces}
+    os.makedirs(output_dir, exist_ok=True)
+    print("Running {} replicas on {} workers...".format(len(jobs), workers or os.cpu_count()))
+
+    start_time = time.time()
+    blocks, spec = share_features(features)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_worker_data, initargs=(spec,)) as pool:
+            rows = list(pool.map(run_replica, [noise_level for noise_level, _ in jobs],
+                                 [replica for _, replica in jobs], itertools.repeat(settings)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    import pandas as pd
+    results = pd.DataFrame(rows)
+    results.to_csv(os.path.join(output_dir, "ensemble_replicas.csv"), index=False)
+    summary = summarize_replicas(results)
+    summary.to_csv(os.path.join(output_dir, "ensemble_summary.csv"), index=False)
+    print(summary.to_string(index=False, float_format="{:.4f}".format))
+    print("Ensemble duration: {} sec".format(round(time.time() - start_time, 2)))
+    return summary
+
+
+def _attach_worker_data(spec):
+    """Attaches to the shared MOER data once per worker process."""
+    _worker_data["blocks"], _worker_data["features"] = attach_features(spec)
+
+
+def parse_args():
+    """ Parses command line arguments """
+    parser = argparse.ArgumentParser(description='Run Monte Carlo ensembles of a policy with noisy forecasts.')
+    parser.add_argument('--data_path', action='store', default='MOER_data/MOERS.csv', help='Path to dataset.')
+    parser.add_argument('--feature_cache', action='store', default=None,
+                        help='Directory of a feature cache to load the dataset\'s features from (and store them in).')
+    parser.add_argument('--noise_levels', action='store', type=float, nargs='+', default=[0.05, 0.1, 0.2],
+                        help='Forecast noise levels: the standard deviation of the relative forecast error at the end '
+                             'of the forecast window (it grows with the square root of the lead time, the current '
+                             'MOER is known exactly).  The perfect forecast (0) is always run as the reference.')
+    parser.add_argument('--replicas', action='store', type=int, default=100,
+                        help='Number of replicas (independently seeded noise) per noise level, defaults to 100.')
+    parser.add_argument('--seed', action='store', type=int, default=0, help='Base seed of the forecast noise.')
+    parser.add_argument('--policy', action='store', default='zeroes_forecast_hist',
+                        choices=['forecast', 'zeroes_forecast', 'forecast_hist', 'zeroes_forecast_hist'],
+                        help='Policy of the replicas, defaults to zeroes_forecast_hist.')
+    parser.add_argument('--engine', action='store', default='dp', choices=['lp', 'highs', 'dp'],
+                        help='Decision engine of the replicas, defaults to dp.')
+    parser.add_argument('--lookahead_mins', action='store', type=int, default=60,
+                        help='Length of the forecast window in minutes, defaults to 60.')
+    parser.add_argument('--timesteps', action='store', default='all',
+                        help='The number of timesteps to run for every replica, defaults to size of dataset.')
+    parser.add_argument('--workers', action='store', type=int, default=os.cpu_count(),
+                        help='Number of worker processes, defaults to the number of cores.')
+    parser.add_argument('--output_dir', action='store', default='./output_data/ensemble/',
+                        help='Directory for the result tables (and traces).')
+    parser.add_argument('--keep_traces', action='store_true', default=False,
+                        help='Write every replica\'s trace (.npy), instead of only its totals.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.feature_cache is not None:
+        moer_features = load_moer_features(args.data_path, args.feature_cache)
+    else:
+        moer_features = MoerFeatures.compute(load_moer_data(args.data_path)[1], 5, 5)
+    run_ensemble(moer_features, args.noise_levels, args.replicas, args.output_dir, workers=args.workers,
+                 policy=args.policy, engine=args.engine, lookahead_mins=args.lookahead_mins,
+                 timesteps=args.timesteps, seed=args.seed, keep_traces=args.keep_traces)
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import zipfile
+import numpy as np
+from moer_features import MINS_PER_DAY, compute_historical_averages, compute_timeslot_ids
+
+FEATURE_CACHE_VERSION = 3  # bump when the cached features (or how they are computed) change
+
+
+class MoerFeatures:
+    """
+    The per-timestep features of the simulated part of a MOER dataset, as numpy arrays: everything the Simulator
+    derives from the dataset, so that it can be loaded from a feature cache without parsing the dataset again.
+    """
+
+    def __init__(self, moers, timeslot_ids, hist_avgs, hist_datapoints, hist_bucket_mins, seeded):
+        """
+        :param moers: numpy array of the MOER of every timestep
+        :param timeslot_ids: numpy array of the time-of-day slot of every timestep (see compute_timeslot_ids)
+        :param hist_avgs: numpy array of the historical average MOER at every timestep
+        :param hist_datapoints: numpy array of the number of datapoints of the historical average at every timestep
+        :param hist_bucket_mins: the size of the time-of-day buckets of the slots and averages, in minutes
+        :param seeded: whether the historical averages are seeded with the day of data preceding the simulation
+        """
+        self.moers = moers
+        self.timeslot_ids = timeslot_ids
+        self.hist_avgs = hist_avgs
+        self.hist_datapoints = hist_datapoints
+        self.hist_bucket_mins = hist_bucket_mins
+        self.seeded = seeded
+
+    def __len__(self):
+        return len(self.moers)
+
+    @classmethod
+    def compute(cls, sim_moer_data, hist_bucket_mins, mins_per_timestep, seed_data=None):
+        """
+        :param sim_moer_data: pandas dataframe of the simulated MOER data, with "timestamp" and "MOER" columns
+        :param hist_bucket_mins: the size of the time-of-day buckets historical averages are collected in, in minutes
+        :param mins_per_timestep: size of one timestep in minutes
+        :param seed_data: optional pandas dataframe of the MOER data immediately preceding sim_moer_data, used only to
+                          seed the historical averages
+        :return: the MoerFeatures of sim_moer_data, the same as the Simulator computes for a dataframe
+        """
+        import pandas as pd  # deferred, loading cached features doesn't need pandas
+        all_data = sim_moer_data if seed_data is None else pd.concat([seed_data, sim_moer_data], ignore_index=True)
+        num_seed_rows = all_data.shape[0] - sim_moer_data.shape[0]
+        timeslot_ids = compute_timeslot_ids(all_data["timestamp"], hist_bucket_mins)
+        averages, datapoints = compute_historical_averages(all_data["MOER"].to_numpy(), timeslot_ids,
+                                                           MINS_PER_DAY // mins_per_timestep)
+        moers = sim_moer_data["MOER"].to_numpy()
+        return cls(moers, timeslot_ids[num_seed_rows:], averages[num_seed_rows:],
+                   datapoints[num_seed_rows:], hist_bucket_mins, seed_data is not None)
+
+
+def hash_dataset(data_path):
+    """
+    :param data_path: path to a dataset file
+    :return: the hex SHA-256 digest of the file's contents
+    """
+    digest = hashlib.sha256()
+    with open(data_path, 'rb') as data_file:
+        for block in iter(lambda: data_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_moer_features(data_path, cache_dir, hist_bucket_mins=5, seed_first_day=False, mins_per_timestep=5):
+    """
+    Loads the features of a MOER dataset from the feature cache, computing (and caching) them if they aren't cached
+    yet.  Cache files are keyed by the dataset's content hash and the settings the features depend on, so a changed
+    dataset or different settings never load stale features.
+
+    :param data_path: path to the MOER .csv file
+    :param cache_dir: directory of the feature cache files
+    :param hist_bucket_mins: the size of the time-of-day buckets historical averages are collected in, in minutes
+    :param seed_first_day: whether to seed the historical averages with the day of data preceding the simulation
+    :param mins_per_timestep: size of one timestep in minutes
+    :return: MoerFeatures of the simulated part of the dataset (see refrigerator_sim.load_moer_data)
+    """
+    key = {"version": FEATURE_CACHE_VERSION, "dataset_sha256": hash_dataset(data_path),
+           "hist_bucket_mins": hist_bucket_mins, "seed_first_day": seed_first_day,
+           "mins_per_timestep": mins_per_timestep}
+    key_hash = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, "moer_features_{}.npz".format(key_hash))
+
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                if json.loads(str(cached["key"])) == key:
+                    return MoerFeatures(cached["moers"], cached["timeslot_ids"], cached["hist_avgs"],
+                                        cached["hist_datapoints"], hist_bucket_mins, seed_first_day)
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            pass  # unreadable or incomplete cache file, recompute it
+        print("Ignoring invalid feature cache file", cache_path)
+
+    from refrigerator_sim import load_moer_data  # deferred, refrigerator_sim imports this module
+    initial_historical_data, sim_moer_data = load_moer_data(data_path)
+    features = MoerFeatures.compute(sim_moer_data, hist_bucket_mins, mins_per_timestep,
+                                    initial_historical_data if seed_first_day else None)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = "{}.{}.tmp".format(cache_path, os.getpid())  # parallel sweep workers may compute the same features
+    with open(temp_path, 'wb') as cache_file:
+        np.savez(cache_file, key=json.dumps(key, sort_keys=True), moers=features.moers,
+                 timeslot_ids=features.timeslot_ids, hist_avgs=features.hist_avgs,
+                 hist_datapoints=features.hist_datapoints)
+    os.replace(temp_path, cache_path)
+    return features
@@ -0,0 +1,213 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from decision_engines import first_decisions
+from feature_cache import MoerFeatures
+from moer_features import hist_extension_length
+from refrigerator import Refrigerator
+from refrigerator_sim import load_moer_data
+
+
+class FleetSimulator:
+    """
+    A simulator for a fleet of refrigerators/smart plugs on the same grid signal.  The state of every device is held
+    in numpy arrays, and all devices are advanced together, one timestep at a time, with the same policies as
+    Simulator.run.
+    """
+    DEVICE_PARAMS = ["MIN_TEMP", "MAX_TEMP", "WATTAGE", "WARMING_RATE", "COOLING_RATE"]
+
+    def __init__(self, moer_data, output_dir, num_timesteps, devices, lookahead_mins=60, max_hist_extension=6,
+                 hist_bucket_mins=5, seed_data=None):
+        """
+        :param moer_data: a pandas dataframe containing the simulation MOER data
+        :param output_dir: a path to the directory for outputting simulation artifacts
+        :param num_timesteps: the number of timesteps (data rows) to process per simulation
+        :param devices: a pandas dataframe with one row per device, and columns "initial_temp" and any of
+                        DEVICE_PARAMS (missing columns default to the Refrigerator constants)
+        :param lookahead_mins: the length of the (perfect) MOER forecast window, in minutes
+        :param max_hist_extension: the maximum number of timesteps of historical averages to extend the forecast by
+        :param hist_bucket_mins: the size of the time-of-day buckets historical averages are collected in, in minutes
+        :param seed_data: an optional pandas dataframe of the MOER data immediately preceding moer_data, used only to
+                          seed the historical averages
+        """
+        self.mins_per_timestep = 5  # size of one timestep in minutes
+        self.lookahead_window = int(lookahead_mins / self.mins_per_timestep)
+        self.max_hist_extension = max_hist_extension
+        self.output_dir = output_dir
+        self.number_timesteps_to_process = num_timesteps
+        features = MoerFeatures.compute(moer_data, hist_bucket_mins, self.mins_per_timestep, seed_data)
+        self.np_moer_vector = features.moers
+        self.np_hist_avg_vector = features.hist_avgs
+        self.np_hist_datapoints = features.hist_datapoints
+
+        self.devices = devices.reset_index(drop=True)
+        self.num_devices = self.devices.shape[0]
+        self.initial_temps = self.devices["initial_temp"].to_numpy(dtype=float)
+        for param in self.DEVICE_PARAMS:
+            default = getattr(Refrigerator, param)
+            values = self.devices[param] if param in self.devices else np.full(self.num_devices, default)
+            setattr(self, param.lower(), np.asarray(values, dtype=float))
+
+        self.temps = None
+        self.on = None
+        self.lbs_co2 = None
+        self.mins_on = None
+
+    @staticmethod
+    def make_devices(num_devices, spread=0.1, seed=0):
+        """
+        Creates a randomly varied fleet: every device constant is drawn uniformly within +/- spread (relative) of the
+        Refrigerator constant, and initial temperatures are drawn uniformly from each device's band.
+
+        :param num_devices: the number of devices in the fleet
+        :param spread: the relative variation of each device constant
+        :param seed: seed for the random number generator
+        :return: a pandas dataframe of devices, as expected by FleetSimulator
+        """
+        rng = np.random.default_rng(seed)
+        devices = {}
+        for param in FleetSimulator.DEVICE_PARAMS:
+            devices[param] = getattr(Refrigerator, param) * rng.uniform(1 - spread, 1 + spread, num_devices)
+        devices["MAX_TEMP"] = np.maximum(devices["MAX_TEMP"], devices["MIN_TEMP"] + 1)
+        devices["initial_temp"] = rng.uniform(devices["MIN_TEMP"], devices["MAX_TEMP"])
+        return pd.DataFrame(devices)
+
+    def run(self, *, use_zeroes=False, use_forecast=False, use_hist=False):
+        """
+        Simulates every device of the fleet over the simulation period, with the same policies as Simulator.run, and
+        writes per-device results and an aggregate time series to .csv files.
+
+        :param use_zeroes: whether to make default decision to turn on (if possible) in timesteps with a MOER value of 0
+        :param use_forecast: whether to incorporate the forecast window into decision making.
+        :param use_hist: whether to extend the forecast window using historical averages as they become available.
+        :return: numpy array of the lbs CO2 emitted by each device
+        """
+        if use_hist and not use_forecast:
+            raise Exception("If historical averages are being used, forecast window must be too.")
+
+        start_time = time.time()
+        dt = self.mins_per_timestep
+        self.temps = self.initial_temps.copy()
+        self.on = np.zeros(self.num_devices, dtype=bool)
+        self.lbs_co2 = np.zeros(self.num_devices)
+        self.mins_on = np.zeros(self.num_devices)
+        co2_per_moer = Refrigerator.lbs_co2_per_moer(self.wattage, dt)  # for one timestep spent on
+
+        num_steps = self.number_timesteps_to_process
+        timeseries = {"time": np.arange(num_steps) * dt,
+                      "moer": self.np_moer_vector[:num_steps],
+                      "devices_on": np.zeros(num_steps, dtype=np.int64),
+                      "mean_temp": np.zeros(num_steps),
+                      "lbs_co2": np.zeros(num_steps)}
+        print("\nRunning fleet simulation ({} devices, {})...".format(self.num_devices, self._get_run_id(
+            use_zeroes, use_forecast, use_hist)))
+
+        for timestep in range(num_steps):
+            moer = self.np_moer_vector[timestep]
+            # the expected temps if the devices continue in their current state (on/off) for another timestep
+            expected_temps = self.temps + dt * np.where(self.on, self.cooling_rate, self.warming_rate)
+
+            if use_zeroes and moer == 0:
+                # if the MOERS are free and the fridge isn't too cold, turn on!  Otherwise we HAVE to turn off.
+                self.on = expected_temps > self.min_temp
+            elif use_forecast:
+                self.on = self._get_next_decisions(timestep, use_hist).astype(bool)
+            else:  # case using no data at all
+                self.on = np.where(expected_temps <= self.min_temp, False,
+                                   np.where(expected_temps >= self.max_temp, True, self.on))
+
+            step_co2 = np.where(self.on, np.round(moer * co2_per_moer, 8), 0)
+            self.lbs_co2 += step_co2
+            self.mins_on += self.on * dt
+            timeseries["devices_on"][timestep] = np.count_nonzero(self.on)
+            timeseries["mean_temp"][timestep] = self.temps.mean()
+            timeseries["lbs_co2"][timestep] = step_co2.sum()
+
+            self.temps = self.temps + dt * np.where(self.on, self.cooling_rate, self.warming_rate)
+
+        run_id = self._get_run_id(use_zeroes, use_forecast, use_hist)
+        self._write_output(run_id, timeseries)
+        self._print_results(start_time)
+        return self.lbs_co2
+
+    def _get_next_decisions(self, start_timestep, use_historicals=False):
+        """
+        Decides the on/off status of every device for this timestep, by solving every device's forecast window
+        problem at once (see decision_engines.first_decisions).
+
+        :param start_timestep: the index of this timestep in the simulation
+        :param use_historicals: whether or not to attempt to extend the forecast window using historical averages
+        :return: numpy array with one decision per device, 0 if the device should be off, 1 if it should be on
+        """
+        moer_vector = self.np_moer_vector[start_timestep: start_timestep + self.lookahead_window]
+        if use_historicals:
+            hist_lookahead_window = hist_extension_length(self.np_hist_datapoints[start_timestep],
+                                                          self.max_hist_extension)
+            hist_start = start_timestep + self.lookahead_window
+            moer_vector = np.concatenate((moer_vector,
+                                          self.np_hist_avg_vector[hist_start: hist_start + hist_lookahead_window]))
+        dt = self.mins_per_timestep
+        return first_decisions(moer_vector, self.temps, self.warming_rate * dt, self.cooling_rate * dt,
+                               self.min_temp, self.max_temp)
+
+    def _get_run_id(self, use_zeroes, use_forecast, use_hist):
+        """Generates a descriptive name for a fleet simulation run."""
+        flags = [name for name, used in (("zeroes", use_zeroes), ("forecast", use_forecast), ("hist", use_hist))
+                 if used]
+        return "_".join(flags) if flags else "no_data"
+
+    def _write_output(self, run_id, timeseries):
+        """
+        Writes per-device results (fleet_devices_*.csv) and the aggregate time series (fleet_timeseries_*.csv).
+
+        :param run_id: the descriptive name of this run
+        :param timeseries: dict of aggregate time series columns
+        """
+        devices = self.devices.copy()
+        devices["lbs_co2"] = self.lbs_co2
+        devices["mins_on"] = self.mins_on
+        devices.to_csv(os.path.join(self.output_dir, "fleet_devices_" + run_id + ".csv"), index_label="device")
+        pd.DataFrame(timeseries).to_csv(os.path.join(self.output_dir, "fleet_timeseries_" + run_id + ".csv"),
+                                        index=False)
+
+    def _print_results(self, start_time):
+        percentiles = np.percentile(self.lbs_co2, [5, 50, 95])
+        print("=" * 50)
+        print("Total fleet lbs CO2 emitted: ", self.lbs_co2.sum())
+        print("Per-device lbs CO2: mean {:.4f}, p5 {:.4f}, median {:.4f}, p95 {:.4f}".format(
+            self.lbs_co2.mean(), *percentiles))
+        print("Fleet simulation duration: {} sec".format(round(time.time() - start_time, 2)))
+
+
+def parse_args():
+    """ Parses command line arguments """
+    parser = argparse.ArgumentParser(description='Simulate a fleet of smart-plug refrigerators on one grid signal.')
+    parser.add_argument('--devices', action='store', type=int, default=1000, help='Number of devices in the fleet.')
+    parser.add_argument('--spread', action='store', type=float, default=0.1,
+                        help='Relative variation of the device constants across the fleet, defaults to 0.1.')
+    parser.add_argument('--seed', action='store', type=int, default=0, help='Random seed for generating the fleet.')
+    parser.add_argument('--zeroes', action='store_true', default=False,
+                        help='Use simple decision on zero-MOER timesteps.')
+    parser.add_argument('--forecast', action='store_true', default=False, help='Use the forecast window.')
+    parser.add_argument('--hist', action='store_true', default=False,
+                        help='Extend the forecast window with historical averages.')
+    parser.add_argument('--lookahead', action='store', type=int, default=60,
+                        help='Length of the forecast window in minutes, defaults to 60.')
+    parser.add_argument('--data_path', action='store', default='MOER_data/MOERS.csv', help='Path to dataset.')
+    parser.add_argument('--timesteps', action='store', default='all',
+                        help='The number of timesteps to run for this simulation, defaults to size of dataset.')
+    parser.add_argument('--output_dir', action='store', default='./output_data/', help='Directory for output data.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    initial_historical_data, sim_moer_data = load_moer_data(args.data_path)
+    timesteps = sim_moer_data.shape[0] if args.timesteps == 'all' else int(args.timesteps)
+    fleet = FleetSimulator(sim_moer_data, args.output_dir, timesteps,
+                           FleetSimulator.make_devices(args.devices, args.spread, args.seed),
+                           lookahead_mins=args.lookahead)
+    fleet.run(use_zeroes=args.zeroes, use_forecast=args.forecast, use_hist=args.hist)
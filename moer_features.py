@@ -0,0 +1,209 @@
+from collections import deque
+from datetime import datetime
+import numpy as np
+
+MINS_PER_DAY = 24 * 60
+
+
+def compute_timeslot_ids(timestamps, bucket_mins):
+    """
+    Maps each timestamp to the index of its time-of-day bucket, e.g. with 60 minute buckets 00:00-00:55 is slot 0,
+    01:00-01:55 is slot 1, and so on.
+
+    :param timestamps: a pandas series of timestamp strings, as found in the MOER dataset
+    :param bucket_mins: the size of one time-of-day bucket, in minutes (must divide a day evenly)
+    :return: numpy integer array of slot indices, one per timestamp
+    """
+    if MINS_PER_DAY % bucket_mins != 0:
+        raise Exception("Historical average bucket size must divide a day evenly, got {} minutes.".format(bucket_mins))
+    import pandas as pd  # deferred, pandas is only needed to parse whole datasets
+    times = pd.to_datetime(timestamps, format="ISO8601")
+    mins_into_day = times.dt.hour.to_numpy() * 60 + times.dt.minute.to_numpy()
+    return (mins_into_day // bucket_mins).astype(np.int64)
+
+
+def hist_extension_length(num_datapoints, max_hist_extension):
+    """
+    :param num_datapoints: the number of datapoints of the historical average at the start of the forecast window
+    :param max_hist_extension: the maximum number of timesteps of historical averages to extend the window by
+    :return: the number of timesteps of historical averages to extend the forecast window by, in proportion to the
+             quality of the averages
+    """
+    return min(num_datapoints, max_hist_extension)
+
+
+def compute_timeslot_id(timestamp, bucket_mins):
+    """
+    Single timestamp counterpart of compute_timeslot_ids, for data that arrives one row at a time.
+
+    :param timestamp: a timestamp string, as found in the MOER dataset
+    :param bucket_mins: the size of one time-of-day bucket, in minutes (must divide a day evenly)
+    :return: the index of the timestamp's time-of-day slot
+    """
+    if MINS_PER_DAY % bucket_mins != 0:
+        raise Exception("Historical average bucket size must divide a day evenly, got {} minutes.".format(bucket_mins))
+    time = datetime.fromisoformat(timestamp)
+    return (time.hour * 60 + time.minute) // bucket_mins
+
+
+def compute_historical_averages(moers, timeslot_ids, timesteps_per_day):
+    """
+    Computes, for every timestep, the average MOER of its time-of-day slot over all data that is at least one day old,
+    i.e. the historical average that was already known one day before that timestep.  Since the forecast window never
+    reaches a full day ahead, using these averages as predictions never looks into the future of the simulation.
+
+    :param moers: numpy array of MOERs, one per timestep
+    :param timeslot_ids: numpy array of time-of-day slot indices, one per timestep (see compute_timeslot_ids)
+    :param timesteps_per_day: the number of timesteps in one day
+    :return: (averages, datapoints) numpy arrays: the historical average MOER at each timestep (0 where there is no
+             history yet), and the number of MOERs in that average (0 where there is no history yet)
+    """
+    import pandas as pd
+    grouped = pd.Series(moers, dtype=float).groupby(timeslot_ids)
+    counts = grouped.cumcount().to_numpy() + 1  # same-slot MOERs up to and including each timestep
+    running_avgs = grouped.cumsum().to_numpy() / counts
+
+    averages = np.zeros(len(moers))
+    datapoints = np.zeros(len(moers), dtype=np.int64)
+    if len(moers) > timesteps_per_day:
+        averages[timesteps_per_day:] = running_avgs[:-timesteps_per_day]
+        datapoints[timesteps_per_day:] = counts[:-timesteps_per_day]
+    return averages, datapoints
+
+
+class RunningHistoricalAverages:
+    """
+    Incremental counterpart of compute_historical_averages, for data that arrives one row at a time: holds the running
+    MOER sum and count of every time-of-day slot, and the last day of rows still waiting to enter those sums.
+    """
+
+    def __init__(self, num_slots, timesteps_per_day):
+        """
+        :param num_slots: the number of time-of-day slots
+        :param timesteps_per_day: the number of timesteps in one day
+        """
+        self.timesteps_per_day = timesteps_per_day
+        self.slot_sums = [0.0] * num_slots
+        self.slot_counts = [0] * num_slots
+        self.pending = deque()  # (slot, moer) of the last day of rows, not yet included in the averages
+
+    def add(self, slot, moer):
+        """
+        Adds the next row of the data.
+
+        :param slot: the row's time-of-day slot
+        :param moer: the row's MOER
+        :return: (average, datapoints) of the row, as computed by compute_historical_averages
+        """
+        average, datapoints = 0.0, 0
+        if len(self.pending) == self.timesteps_per_day:
+            # the row one day back enters the averages, and its slot's average is the one known one day later
+            day_old_slot, day_old_moer = self.pending.popleft()
+            self.slot_sums[day_old_slot] += day_old_moer
+            self.slot_counts[day_old_slot] += 1
+            average = self.slot_sums[day_old_slot] / self.slot_counts[day_old_slot]
+            datapoints = self.slot_counts[day_old_slot]
+        self.pending.append((slot, moer))
+        return average, datapoints
+
+    def predict(self, num_rows):
+        """
+        Computes the historical averages of the rows following the last added row, which are already known as they
+        only include data at least one day old.
+
+        :param num_rows: the number of following rows
+        :return: numpy array of the historical average of each following row, as add will return them
+        """
+        averages = np.zeros(num_rows)
+        extra_sums = {}
+        extra_counts = {}
+        num_entered = 0
+        for row in range(num_rows):
+            # rows added until this one push this many of the pending rows into the averages
+            while num_entered < min(len(self.pending) + row + 1 - self.timesteps_per_day, len(self.pending)):
+                slot, moer = self.pending[num_entered]
+                extra_sums[slot] = extra_sums.get(slot, self.slot_sums[slot]) + moer
+                extra_counts[slot] = extra_counts.get(slot, self.slot_counts[slot]) + 1
+                num_entered += 1
+                averages[row] = extra_sums[slot] / extra_counts[slot]
+        return averages
+
+
+# Multi-resolution planning horizons: (span_mins, step_mins) segments, from the near term outwards.  Each segment plans
+# span_mins minutes in steps of step_mins minutes, so e.g. "12h" plans the first hour in 5 minute steps, the next three
+# hours in 15 minute steps and the last eight hours in hourly steps (32 steps in total).
+HORIZON_PROFILES = {
+    "1h": [(60, 5)],
+    "4h": [(60, 5), (180, 15)],
+    "8h": [(60, 5), (120, 15), (300, 60)],
+    "12h": [(60, 5), (180, 15), (480, 60)],
+}
+
+
+def parse_horizon_profile(spec):
+    """
+    Parses a horizon profile, given either by name (a key of HORIZON_PROFILES) or as comma separated
+    span_mins:step_mins segments, e.g. "60:5,180:15,480:60".
+
+    :param spec: the profile name or segment string
+    :return: list of (span_mins, step_mins) segments
+    """
+    if spec in HORIZON_PROFILES:
+        return HORIZON_PROFILES[spec]
+    try:
+        profile = [tuple(int(value) for value in segment.split(":")) for segment in spec.split(",")]
+    except ValueError:
+        profile = []
+    if not profile or any(len(segment) != 2 for segment in profile):
+        raise Exception("Invalid horizon profile '{}', expected one of {} or span:step segments such as "
+                        "'60:5,180:15'.".format(spec, ", ".join(HORIZON_PROFILES)))
+    return profile
+
+
+def compute_horizon_step_sizes(profile, mins_per_timestep):
+    """
+    :param profile: list of (span_mins, step_mins) segments (see HORIZON_PROFILES)
+    :param mins_per_timestep: size of one timestep in minutes
+    :return: numpy integer array with the number of timesteps of each step of the horizon
+    """
+    step_sizes = []
+    for span_mins, step_mins in profile:
+        if step_mins % mins_per_timestep != 0 or span_mins % step_mins != 0:
+            raise Exception("Horizon segment {}:{} must split into whole steps of whole timesteps ({} min).".format(
+                span_mins, step_mins, mins_per_timestep))
+        step_sizes += [step_mins // mins_per_timestep] * (span_mins // step_mins)
+    return np.array(step_sizes, dtype=np.int64)
+
+
+def check_horizon_span(profile, lookahead_mins):
+    """
+    Raises if a horizon ends before the forecast window, since the window's forecast beyond the horizon would be
+    discarded.
+
+    :param profile: list of (span_mins, step_mins) segments (see HORIZON_PROFILES)
+    :param lookahead_mins: the length of the forecast window, in minutes
+    """
+    horizon_mins = sum(span_mins for span_mins, _ in profile)
+    if horizon_mins < lookahead_mins:
+        raise Exception("Horizon of {} minutes is shorter than the {} minute forecast window, extend the horizon to "
+                        "plan over the whole forecast.".format(horizon_mins, lookahead_mins))
+
+
+def aggregate_horizon(moers, step_sizes):
+    """
+    Averages a window of per-timestep MOERs over the steps of a horizon.  If the window is shorter than the horizon
+    (e.g. at the end of the data), the horizon is cut short, and its last step may cover fewer timesteps.
+
+    :param moers: numpy array of (forecast or predicted) MOERs, one per timestep
+    :param step_sizes: numpy integer array with the number of timesteps of each step (see compute_horizon_step_sizes)
+    :return: (step_moers, step_sizes) numpy arrays: the average MOER and the number of timesteps of each step
+    """
+    ends = np.cumsum(step_sizes)
+    moers = moers[:ends[-1]]
+    if moers.size == 0:
+        return np.array([]), step_sizes[:0]
+    num_steps = np.searchsorted(ends, moers.size) + 1
+    step_sizes = step_sizes[:num_steps].copy()
+    step_sizes[-1] -= ends[num_steps - 1] - moers.size
+    starts = np.concatenate(([0], ends[:num_steps - 1]))
+    return np.add.reduceat(moers, starts) / step_sizes, step_sizes
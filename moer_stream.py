@@ -0,0 +1,151 @@
+import copy
+import numpy as np
+from moer_features import RunningHistoricalAverages, compute_timeslot_ids
+
+
+class MoerStream:
+    """
+    Incremental reader of a MOER dataset, for datasets too large to hold in memory.
+
+    Only a buffer of the upcoming rows (at least the forecast window, at most the window plus one chunk) is held, along
+    with the state needed to compute historical averages on the fly (see moer_features.RunningHistoricalAverages).
+    The historical average features of every row are the same as moer_features.compute_historical_averages computes
+    over the whole dataset.
+
+    The buffered rows are exposed as numpy arrays (moers, hist_avgs, hist_datapoints), indexed by timestep - offset.
+    """
+
+    def __init__(self, open_chunks, chunk_rows):
+        """
+        :param open_chunks: function returning a fresh iterator over the MOER data, as pandas dataframes with
+                            "timestamp" and "MOER" columns; called once per pass over the data
+        :param chunk_rows: the (maximum) number of rows in one chunk
+        """
+        self.open_chunks = open_chunks
+        self.chunk_rows = chunk_rows
+        self.chunks = None
+        self.exhausted = False
+        self.offset = 0
+        self.rows_read = 0
+        self.moers = np.array([])
+        self.hist_avgs = np.array([])
+        self.hist_datapoints = np.array([], dtype=np.int64)
+        self.hist_bucket_mins = None
+        self.timesteps_per_day = None
+        self.running_averages = None
+
+    def start(self, hist_bucket_mins, timesteps_per_day, seed_data=None):
+        """
+        Starts a fresh pass over the data, discarding any buffered rows and historical average state.
+
+        :param hist_bucket_mins: the size of the time-of-day buckets historical averages are collected in, in minutes
+        :param timesteps_per_day: the number of timesteps in one day
+        :param seed_data: an optional pandas dataframe of the MOER data immediately preceding the stream, used only to
+                          seed the historical averages
+        """
+        self.hist_bucket_mins = hist_bucket_mins
+        self.timesteps_per_day = timesteps_per_day
+        self.running_averages = RunningHistoricalAverages(24 * 60 // hist_bucket_mins, timesteps_per_day)
+        self.chunks = iter(self.open_chunks())
+        self.exhausted = False
+        self.offset = 0
+        self.rows_read = 0
+        self.moers = np.array([])
+        self.hist_avgs = np.array([])
+        self.hist_datapoints = np.array([], dtype=np.int64)
+        if seed_data is not None:
+            self._compute_hist_features(seed_data)
+
+    def advance(self, timestep, num_rows):
+        """
+        Makes sure the rows timestep .. timestep + num_rows - 1 are buffered, as far as the data reaches.  Rows before
+        timestep may be dropped from the buffer.
+
+        :param timestep: the index of the first row needed, must never decrease within a pass
+        :param num_rows: the number of rows needed
+        :return: whether the row timestep exists
+        """
+        if timestep + num_rows <= self.offset + len(self.moers) or self.exhausted:
+            return timestep < self.offset + len(self.moers)
+
+        # drop the rows that were already processed, then append chunks until the requested rows are buffered
+        keep = slice(timestep - self.offset, None)
+        moers, hist_avgs, hist_datapoints = [self.moers[keep]], [self.hist_avgs[keep]], [self.hist_datapoints[keep]]
+        self.offset = timestep
+        num_buffered = len(moers[0])
+        while num_buffered < num_rows:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.exhausted = True
+                break
+            chunk_avgs, chunk_datapoints = self._compute_hist_features(chunk)
+            moers.append(chunk["MOER"].to_numpy())
+            hist_avgs.append(chunk_avgs)
+            hist_datapoints.append(chunk_datapoints)
+            num_buffered += len(chunk)
+            self.rows_read += len(chunk)
+        self.moers = _concatenate(moers)
+        self.hist_avgs = _concatenate(hist_avgs)
+        self.hist_datapoints = _concatenate(hist_datapoints)
+        return timestep < self.offset + len(self.moers)
+
+    def get_state(self):
+        """
+        :return: a picklable dict of the stream's position in the current pass, its buffered rows and its historical
+                 average state, for resuming the pass later with set_state
+        """
+        return {"hist_bucket_mins": self.hist_bucket_mins,
+                "timesteps_per_day": self.timesteps_per_day,
+                "rows_read": self.rows_read,
+                "exhausted": self.exhausted,
+                "offset": self.offset,
+                "moers": self.moers,
+                "hist_avgs": self.hist_avgs,
+                "hist_datapoints": self.hist_datapoints,
+                "running_averages": copy.deepcopy(self.running_averages)}
+
+    def set_state(self, state):
+        """
+        Resumes a pass over the data from a state returned by get_state (of a stream over the same data).  The rows
+        read before are skipped without computing their features.
+
+        :param state: a dict returned by get_state
+        """
+        self.hist_bucket_mins = state["hist_bucket_mins"]
+        self.timesteps_per_day = state["timesteps_per_day"]
+        self.rows_read = state["rows_read"]
+        self.exhausted = state["exhausted"]
+        self.offset = state["offset"]
+        self.moers = state["moers"]
+        self.hist_avgs = state["hist_avgs"]
+        self.hist_datapoints = state["hist_datapoints"]
+        self.running_averages = copy.deepcopy(state["running_averages"])
+        self.chunks = _skip_rows(self.open_chunks(), self.rows_read)
+
+    def _compute_hist_features(self, chunk):
+        """
+        Computes the historical average features of a chunk of rows, and updates the per-slot state with them.
+
+        :param chunk: pandas dataframe of the next rows of the data
+        :return: (averages, datapoints) numpy arrays, as returned by moer_features.compute_historical_averages
+        """
+        slots = compute_timeslot_ids(chunk["timestamp"], self.hist_bucket_mins).tolist()
+        averages = np.zeros(len(slots))
+        datapoints = np.zeros(len(slots), dtype=np.int64)
+        for row, (slot, moer) in enumerate(zip(slots, chunk["MOER"].tolist())):
+            averages[row], datapoints[row] = self.running_averages.add(slot, moer)
+        return averages, datapoints
+
+
+def _skip_rows(chunks, num_rows):
+    """Generates the chunks of an iterator over pandas dataframes, without their first num_rows rows."""
+    for chunk in chunks:
+        if num_rows < len(chunk):
+            yield chunk.iloc[num_rows:] if num_rows else chunk
+        num_rows = max(0, num_rows - len(chunk))
+
+
+def _concatenate(arrays):
+    """Concatenates numpy arrays, skipping empty ones so they don't affect the resulting dtype."""
+    non_empty = [array for array in arrays if len(array)]
+    return np.concatenate(non_empty) if non_empty else arrays[0]
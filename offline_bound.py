@@ -0,0 +1,111 @@
+import argparse
+import contextlib
+import io
+import os
+import time
+import numpy as np
+import pandas as pd
+from decision_engines import optimal_schedule
+from refrigerator_sim import load_moer_data
+from simulator import Simulator, parse_policy
+
+POLICIES = ["no_data", "zeroes", "zeroes_forecast", "zeroes_forecast_hist"]
+
+
+class ScheduleSimulator(Simulator):
+    """A Simulator that replays a fixed on/off schedule (one status per timestep) instead of deciding."""
+
+    def __init__(self, schedule, *args, name="optimal", **kwargs):
+        """
+        :param schedule: numpy boolean array with the status of every timestep
+        :param name: the name of the schedule, used in the output filename (sim_output_<name>.csv) and plot title
+        :param args: the Simulator's arguments
+        :param kwargs: the Simulator's keyword arguments
+        """
+        super().__init__(*args, **kwargs)
+        self.schedule = schedule
+        self.name = name
+
+    def run(self, **kwargs):
+        """Runs the simulation with the schedule, see Simulator.run (the policy flags are set by the schedule)."""
+        return super().run(use_forecast=True, **kwargs)
+
+    def _get_output_filename(self, use_zeroes, use_forecast, use_hist):
+        return self.output_dir.rstrip("/") + "/" + "sim_output_" + self.name + "." + self.trace_format
+
+    def _get_next_decision(self, start_timestep, use_historicals=False):
+        self.forecast_decisions += 1
+        return int(self.schedule[self.timesteps_processed - 1])
+
+
+def compute_bound(simulator, num_timesteps):
+    """
+    Computes the perfect-foresight optimal schedule of a simulator's fridge over its data.
+
+    :param simulator: a Simulator with in-memory data, whose fridge constants and timestep define the problem
+    :param num_timesteps: the number of timesteps of the schedule
+    :return: (schedule, lbs_co2): numpy boolean array with the status of every timestep, and its total lbs CO2
+    """
+    fridge = simulator.fridge
+    step_co2 = np.array([simulator._lbs_co2_from_moer(moer) for moer in simulator.np_moer_vector[:num_timesteps]])
+    return optimal_schedule(step_co2, fridge.current_temp, fridge.WARMING_RATE * simulator.mins_per_timestep,
+                            fridge.COOLING_RATE * simulator.mins_per_timestep, fridge.MIN_TEMP, fridge.MAX_TEMP)
+
+
+def count_out_of_band(output_filename, fridge):
+    """
+    :param output_filename: path of a simulation's csv output
+    :param fridge: the simulation's Refrigerator
+    :return: the number of timesteps the fridge started outside its temperature band (beyond the output's rounding)
+    """
+    temps = pd.read_csv(output_filename)["fridge_temp"].to_numpy()
+    return int(np.count_nonzero((temps < fridge.MIN_TEMP - 0.005) | (temps > fridge.MAX_TEMP + 0.005)))
+
+
+def parse_args():
+    """ Parses command line arguments """
+    parser = argparse.ArgumentParser(description='Compare every policy against the perfect-foresight optimum.')
+    parser.add_argument('--data_path', action='store', default='MOER_data/MOERS.csv', help='Path to dataset.')
+    parser.add_argument('--engine', action='store', default='dp', choices=['lp', 'highs', 'dp'],
+                        help='Decision engine for the forecast policies, defaults to dp.')
+    parser.add_argument('--timesteps', action='store', default='all',
+                        help='The number of timesteps to run for this simulation, defaults to size of dataset.')
+    parser.add_argument('--output_dir', action='store', default='./output_data/bound/',
+                        help='Directory for the optimal trace, the policies\' traces and the comparison table.')
+    parser.add_argument('--plot', action='store_true', default=False, help='Plot the optimal trace and every policy.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    initial_historical_data, sim_moer_data = load_moer_data(args.data_path)
+    timesteps = sim_moer_data.shape[0] if args.timesteps == 'all' else int(args.timesteps)
+
+    bound_start = time.time()
+    bound_simulator = Simulator(sim_moer_data, args.output_dir, timesteps)
+    optimal, bound_lbs_co2 = compute_bound(bound_simulator, timesteps)
+    bound_secs = time.time() - bound_start
+    print("Perfect-foresight optimum: {:.4f} lbs CO2 ({} timesteps, computed in {:.2f} sec)".format(
+        bound_lbs_co2, timesteps, bound_secs))
+
+    rows = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        schedule_simulator = ScheduleSimulator(optimal, sim_moer_data, args.output_dir, timesteps)
+        optimal_filename = schedule_simulator.run(engine=args.engine, plot=args.plot)
+        for policy in POLICIES:
+            policy_flags = parse_policy(policy)
+            simulator = Simulator(sim_moer_data, args.output_dir, timesteps)
+            simulator.run(engine=args.engine, plot=args.plot, **policy_flags)
+            rows.append((policy, simulator))
+    rows.append(("optimal", schedule_simulator))
+
+    comparison = pd.DataFrame({"policy": [policy for policy, _ in rows],
+                               "total_lbs_co2": [simulator.total_lbs_co2 for _, simulator in rows],
+                               "pct_of_optimal": [100 * simulator.total_lbs_co2 / bound_lbs_co2
+                                                  for _, simulator in rows],
+                               "out_of_band_timesteps": [count_out_of_band(simulator.output_filename, simulator.fridge)
+                                                         for _, simulator in rows]})
+    comparison.to_csv(os.path.join(args.output_dir, "bound_comparison.csv"), index=False)
+    print(comparison.to_string(index=False, float_format="{:.4f}".format))
+    print("Optimal schedule written to", optimal_filename)
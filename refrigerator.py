@@ -6,7 +6,14 @@ class Refrigerator:
     WARMING_RATE = 5/60  # degrees/minute
     COOLING_RATE = -10/60  # degrees/minute
 
-    def __init__(self):
+    def __init__(self, **params):
+        """
+        :param params: optional overrides of the constants above for this refrigerator, e.g. MAX_TEMP=45
+        """
+        for name, value in params.items():
+            if not name.isupper() or not hasattr(self, name):
+                raise Exception("Unknown refrigerator parameter '{}'.".format(name))
+            setattr(self, name, value)
         self.on = False
         self.current_temp = self.MIN_TEMP  # simulation begins at coldest temp
         self.current_timestamp = 0  # minutes
@@ -34,3 +41,56 @@ class Refrigerator:
 
     def turn_off(self):
         self.on = False
+
+    def set_status(self, decision):
+        """
+        :param decision: 0 to turn the refrigerator off, 1 to turn it on
+        """
+        if decision == 0:
+            self.turn_off()
+        else:
+            self.turn_on()
+
+    def apply_zero_moer_rule(self, expected_temp):
+        """
+        Decides the status for a timestep with a MOER of 0: run while the energy is free, unless it is getting too cold.
+
+        :param expected_temp: the expected temperature at the end of the timestep if the status doesn't change
+        """
+        if expected_temp > self.MIN_TEMP:
+            self.turn_on()  # if the MOERS are free and the fridge isn't too cold, turn on!
+        else:
+            self.turn_off()  # we HAVE to turn off, getting too cold
+
+    def apply_thermostat_rule(self, expected_temp):
+        """
+        Decides the status for a timestep without any MOER data: keep the current status unless the expected
+        temperature leaves the allowed band.
+
+        :param expected_temp: the expected temperature at the end of the timestep if the status doesn't change
+        """
+        if expected_temp <= self.MIN_TEMP:
+            self.turn_off()
+        elif expected_temp >= self.MAX_TEMP:
+            self.turn_on()
+
+    @staticmethod
+    def lbs_co2_per_moer(wattage, mins):
+        """
+        :param wattage: the wattage of the refrigerator (or a numpy array of wattages, one per device)
+        :param mins: the running time, in minutes
+        :return: the lbs of CO2 generated per unit of MOER by running for some minutes
+        """
+        megawatts_per_watt = 1 / 1000000
+        hours_per_minute = 1 / 60
+        return (wattage * megawatts_per_watt) * (mins * hours_per_minute)
+
+    def lbs_co2_from_moer(self, moer, mins):
+        """
+        Calculates the lbs of CO2 the refrigerator generates running for some minutes with this MOER.
+
+        :param moer: the MOER from which to calculate lbs CO2
+        :param mins: the running time, in minutes
+        :return: the lbs CO2, rounded to 8 decimal places
+        """
+        return round(moer * self.lbs_co2_per_moer(self.WATTAGE, mins), 8)
@@ -1,8 +1,16 @@
+import time
+_import_start = time.perf_counter()  # timed from the top of the entry point, so all imports are included
 import argparse
 import os
-import pandas as pd
 import subprocess
+from decision_cache import DecisionCache
+from feature_cache import load_moer_features
+from moer_features import HORIZON_PROFILES, parse_horizon_profile
+from moer_stream import MoerStream
 from simulator import Simulator
+from trace_files import TRACE_FORMATS
+
+IMPORT_SECS = time.perf_counter() - _import_start  # the solver and plotting libraries are imported later, if needed
 
 
 def parse_args():
@@ -24,13 +32,110 @@ def parse_args():
     parser.add_argument('--data_path', action='store', default='MOER_data/MOERS.csv', help='Path to dataset.')
     parser.add_argument('--timesteps', action='store', default='all',
                         help='The number of timesteps to run for this simulation, defaults to size of dataset.')
+    parser.add_argument('--engine', action='store', default='lp', choices=['lp', 'highs', 'dp'],
+                        help='Decision engine for the forecast window: PuLP/CBC linear program (lp), persistent '
+                             'in-process HiGHS model (highs, requires highspy) or exact dynamic programming (dp, '
+                             'fastest).')
+    parser.add_argument('--lookahead', action='store', type=int, default=60,
+                        help='Length of the forecast window in minutes, defaults to 60.')
+    parser.add_argument('--horizon', action='store', default=None,
+                        help='Plan over a multi-resolution horizon: one of {} or span:step segments in minutes, e.g. '
+                             '60:5,180:15,480:60 (the first hour in 5 minute steps, then 15 and 60 minute steps).  '
+                             'It must reach at least as far as --lookahead.  With --hist, historical averages extend '
+                             'the forecast to the end of the horizon.'.format(
+                                 ", ".join(HORIZON_PROFILES)))
+    parser.add_argument('--bucket_mins', action='store', type=int, default=5,
+                        help='Size of the time-of-day buckets historical MOER averages are collected in, in minutes '
+                             '(e.g. 5, 15, 60), defaults to 5.')
+    parser.add_argument('--seed_first_day', action='store_true', default=False,
+                        help='Seed the historical averages with the day of data preceding the simulation.')
+    parser.add_argument('--cache_size', action='store', type=int, default=0,
+                        help='Cache up to this many forecast-window decisions (LRU), skipping the decision engine for '
+                             'repeated problems.  Defaults to 0 (no cache).')
+    parser.add_argument('--cache_path', action='store', default=None,
+                        help='File to load cached decisions from and save them to, to reuse them between runs.  '
+                             'Requires --cache_size.')
+    parser.add_argument('--no_plot', action='store_true', default=False,
+                        help='Headless mode: skip plotting, so matplotlib is never imported.')
+    parser.add_argument('--plot_format', action='store', default='pdf', choices=['pdf', 'png'],
+                        help='File format of the plots: pdf (vector) or png (raster, smaller and faster for long '
+                             'simulations), defaults to pdf.')
+    parser.add_argument('--trace_format', action='store', default='csv', choices=TRACE_FORMATS,
+                        help='File format of the simulation output: csv (text) or npy (binary records, written without '
+                             'text formatting and read memory-mapped when plotting), defaults to csv.')
+    parser.add_argument('--max_plot_points', action='store', type=int, default=None,
+                        help='Decimate plotted traces to about this many points, keeping the minimum and maximum of '
+                             'every stretch of data.  Useful for multi-month simulations.')
+    parser.add_argument('--stream', action='store_true', default=False,
+                        help='Read the dataset in chunks instead of loading it into memory, for multi-year datasets.  '
+                             'Output is written incrementally, and results are the same as without streaming.')
+    parser.add_argument('--feature_cache', action='store', default=None,
+                        help='Directory of a feature cache: the parsed MOERs, time-of-day slots and historical '
+                             'averages of the dataset are loaded from it instead of recomputed, and computed and '
+                             'stored on the first run.  Keyed by the dataset\'s contents and the bucket/seed '
+                             'settings.  Not used with --stream.')
+    parser.add_argument('--chunk_rows', action='store', type=int, default=10000,
+                        help='Rows per chunk read (and written) when streaming, defaults to 10000.')
+    parser.add_argument('--metrics', action='store_true', default=False,
+                        help='Time the phases of each run (decision engine model building and solving, output '
+                             'writing, plotting) and write them, with decision counters, to a JSON summary next to '
+                             'the output csv.')
+    parser.add_argument('--trace_steps', action='store_true', default=False,
+                        help='Also write the timings of every timestep to a csv next to the output csv.  Implies '
+                             '--metrics.')
+    parser.add_argument('--checkpoint_every', action='store', type=int, default=None,
+                        help='Save the state of the simulation every this many timesteps, to resume it with --resume '
+                             'if it dies.  Checkpoints go next to the output, as sim_output_*_checkpoint.pkl.')
+    parser.add_argument('--resume', action='store', default=None,
+                        help='Checkpoint file to resume the simulation from.  The run may use a different policy, '
+                             'engine or horizon than the checkpointed run, to fork a what-if run from it.')
     parser.add_argument('--clean', default=False, action='store_true',
                         help='Delete the current output data directory before starting simulations.')
     return parser.parse_args()
 
 
+def load_moer_data(data_path):
+    """
+    Reads the MOER dataset and splits off the first day (pre 3-1-19), which precedes the simulated month.
+
+    :param data_path: path to the MOER .csv file
+    :return: (initial_historical_data, sim_moer_data) pandas dataframes
+    """
+    import pandas as pd  # deferred, runs from the feature cache don't need pandas
+    all_moer_data = pd.read_csv(data_path)
+    initial_historical_data = all_moer_data[:288]
+    sim_moer_data = all_moer_data[288:-1].reset_index(drop=True)
+    return initial_historical_data, sim_moer_data
+
+
+def stream_moer_data(data_path, chunk_rows=10000):
+    """
+    Streaming counterpart of load_moer_data: only the first day is read up front, the rest of the dataset (the same rows
+    as load_moer_data's sim_moer_data) is read in chunks as the simulation proceeds.
+
+    :param data_path: path to the MOER .csv file
+    :param chunk_rows: the number of rows read at a time
+    :return: (initial_historical_data, sim_moer_data) - a pandas dataframe, and a MoerStream
+    """
+    import pandas as pd
+    initial_historical_data = pd.read_csv(data_path, nrows=288)
+
+    def read_sim_chunks():
+        last_row = None  # held back until the next chunk arrives, so the final row of the dataset is left out
+        for chunk in pd.read_csv(data_path, skiprows=range(1, 289), chunksize=chunk_rows):
+            if last_row is not None:
+                chunk = pd.concat([last_row, chunk])
+            last_row = chunk[-1:]
+            if chunk.shape[0] > 1:
+                yield chunk[:-1]
+
+    return initial_historical_data, MoerStream(read_sim_chunks, chunk_rows)
+
+
 if __name__ == '__main__':
     args = parse_args()
+    if args.cache_path is not None and args.cache_size <= 0:
+        raise Exception("--cache_path requires a decision cache, set its size with --cache_size.")
     output_dir = "./output_data/"
 
     # Clean output directory?
@@ -42,17 +147,30 @@ if __name__ == '__main__':
         os.mkdir(output_dir)
 
     # Read initial MOER data and cut off first day (pre 3-1-19)
-    all_moer_data = pd.read_csv(args.data_path)
-    initial_historical_data = all_moer_data[:288]
-    sim_moer_data = all_moer_data[288:-1].reset_index(drop=True)
+    if args.stream:
+        initial_historical_data, sim_moer_data = stream_moer_data(args.data_path, args.chunk_rows)
+    elif args.feature_cache is not None:
+        initial_historical_data = None  # the features are already seeded, if --seed_first_day
+        sim_moer_data = load_moer_features(args.data_path, args.feature_cache, args.bucket_mins, args.seed_first_day)
+    else:
+        initial_historical_data, sim_moer_data = load_moer_data(args.data_path)
 
     # Number of timesteps (data rows) defaults to full dataset (shrink via command line args for shorter testing cycles)
     if args.timesteps == 'all':
-        args.timesteps = sim_moer_data.shape[0]
+        args.timesteps = None if args.stream else len(sim_moer_data)
     else:
         args.timesteps = int(args.timesteps)
 
-    simulator = Simulator(sim_moer_data, output_dir, args.timesteps)
+    decision_cache = None
+    if args.cache_size > 0:
+        decision_cache = DecisionCache(args.cache_size, args.cache_path)
+
+    simulator = Simulator(sim_moer_data, output_dir, args.timesteps, lookahead_mins=args.lookahead,
+                          decision_cache=decision_cache, hist_bucket_mins=args.bucket_mins,
+                          seed_data=initial_historical_data if args.seed_first_day else None,
+                          plot_format=args.plot_format, max_plot_points=args.max_plot_points,
+                          horizon_profile=parse_horizon_profile(args.horizon) if args.horizon else None,
+                          trace_format=args.trace_format, import_secs=IMPORT_SECS)
 
     # Run simulations based on arguments supplied at command line.
 
@@ -61,17 +179,20 @@ if __name__ == '__main__':
         simulator.plot_avg_moers()
         exit(0)
 
+    run_options = dict(engine=args.engine, plot=not args.no_plot, metrics=args.metrics, trace_steps=args.trace_steps,
+                       checkpoint_every=args.checkpoint_every, resume_from=args.resume)
+
     # Run all simulations in order of increasing performance
     if args.all:  # run all simulation options
-        simulator.run()
-        simulator.run(use_zeroes=True)
-        simulator.run(use_zeroes=True, use_forecast=True)
-        simulator.run(use_zeroes=True, use_forecast=True, use_hist=True)
+        simulator.run(**run_options)
+        simulator.run(use_zeroes=True, **run_options)
+        simulator.run(use_zeroes=True, use_forecast=True, **run_options)
+        simulator.run(use_zeroes=True, use_forecast=True, use_hist=True, **run_options)
         exit(0)
 
     if args.best:
-        simulator.run(use_zeroes=True, use_forecast=True, use_hist=True)
+        simulator.run(use_zeroes=True, use_forecast=True, use_hist=True, **run_options)
         exit(0)
 
     # Otherwise, run the simulation as specified on command line.
-    simulator.run(use_zeroes=args.zeroes, use_forecast=args.forecast, use_hist=args.hist)
+    simulator.run(use_zeroes=args.zeroes, use_forecast=args.forecast, use_hist=args.hist, **run_options)
@@ -0,0 +1,97 @@
+import json
+import time
+import numpy as np
+
+
+class RunMetrics:
+    """
+    Per-phase timers and counters of one simulation run, for attributing where the time of a run goes without an
+    external profiler.  Collected by Simulator.run when metrics are requested, and written as a JSON summary next to
+    the run's output CSV (plus, optionally, a per-timestep trace).
+    """
+    STEP_TRACE_COLUMNS = ["timestep", "decision", "fridge_on", "step_secs", "engine_build_secs", "engine_solve_secs",
+                         "engine_calls"]
+    DECISION_CODES = {"zero_moer": 0, "forecast": 1, "rule": 2}  # decision path of a timestep, in the step trace
+
+    def __init__(self, trace_steps=False):
+        """
+        :param trace_steps: whether to also record one row of timings per timestep
+        """
+        self.trace_steps = trace_steps
+        self.phase_secs = {}
+        self.step_secs = []
+        self.step_rows = []
+        self.phase_start = None
+        self.step_start = None
+        self.engine_totals = (0, 0.0, 0.0)
+
+    def start_phase(self):
+        self.phase_start = time.perf_counter()
+
+    def end_phase(self, name):
+        """Adds the time since the last start_phase call to the named phase."""
+        self.phase_secs[name] = self.phase_secs.get(name, 0.0) + time.perf_counter() - self.phase_start
+
+    def start_step(self):
+        self.step_start = time.perf_counter()
+
+    def end_step(self, timestep, decision, fridge_on, engine):
+        """
+        Records the latency of a timestep, from start_step until now.
+
+        :param timestep: the index of the timestep in the simulation
+        :param decision: the decision path the timestep took, a key of DECISION_CODES
+        :param fridge_on: the fridge's status during the timestep
+        :param engine: the run's decision engine, whose running totals are used to attribute engine time to the step
+        """
+        step_secs = time.perf_counter() - self.step_start
+        self.step_secs.append(step_secs)
+        if self.trace_steps:
+            totals = (engine.calls, engine.build_secs, engine.solve_secs)
+            calls, build_secs, solve_secs = (new - old for new, old in zip(totals, self.engine_totals))
+            self.engine_totals = totals
+            self.step_rows.append((timestep, self.DECISION_CODES[decision], fridge_on, step_secs, build_secs,
+                                   solve_secs, calls))
+
+    def summary(self, simulator):
+        """
+        :param simulator: the Simulator whose run the metrics belong to
+        :return: a dict of the run's timers and counters, as written to the JSON summary
+        """
+        engine = simulator.engine
+        cache = simulator.decision_cache
+        step_ms = np.array(self.step_secs) * 1000 if self.step_secs else np.zeros(1)
+        steps_secs = self.phase_secs.get("steps", 0.0)
+        return {"output": simulator.output_filename,
+                "engine": engine.name,
+                "timesteps": simulator.timesteps_processed,
+                "decisions": {"zero_moer_shortcuts": simulator.zero_moer_decisions,
+                              "forecast": simulator.forecast_decisions,
+                              "rule": simulator.rule_decisions,
+                              "solver_calls": engine.calls,
+                              "cache_hits": cache.hits if cache is not None else 0},
+                "phase_secs": dict(self.phase_secs,
+                                   engine_build=engine.build_secs,
+                                   engine_solve=engine.solve_secs,
+                                   step_overhead=steps_secs - engine.build_secs - engine.solve_secs,
+                                   write_output=simulator.write_secs),
+                "step_latency_ms": {"mean": step_ms.mean(),
+                                    "p50": np.percentile(step_ms, 50),
+                                    "p99": np.percentile(step_ms, 99),
+                                    "max": step_ms.max()},
+                "rows_written": simulator.trace_rows_written,
+                "import_secs": simulator.run_summary["import_secs"]}
+
+    def write(self, simulator, summary_path, step_trace_path=None):
+        """
+        Writes the JSON summary and, if steps were traced, the per-timestep trace (CSV).
+
+        :param simulator: the Simulator whose run the metrics belong to
+        :param summary_path: path of the JSON summary
+        :param step_trace_path: path of the per-timestep trace
+        """
+        with open(summary_path, 'w') as summary_file:
+            json.dump(self.summary(simulator), summary_file, indent=2, default=float)
+        if self.trace_steps and step_trace_path is not None:
+            import pandas as pd
+            pd.DataFrame(self.step_rows, columns=self.STEP_TRACE_COLUMNS).to_csv(step_trace_path, index=False)
@@ -1,166 +1,374 @@
-from pulp import *
 import numpy as np
+import os
+import pickle
+import shutil
 import time
+from decision_engines import create_engine
+from feature_cache import MoerFeatures
+from moer_features import MINS_PER_DAY, aggregate_horizon, check_horizon_span, compute_horizon_step_sizes, \
+    hist_extension_length
+from moer_stream import MoerStream
 from refrigerator import Refrigerator
-from visualizer import Visualizer
+from run_metrics import RunMetrics
+from trace_files import NpyTraceWriter
+
+# Policy name tokens, in the order they appear in policy names, and the Simulator.run flag each one sets
+POLICY_FLAGS = {"zeroes": "use_zeroes", "forecast": "use_forecast", "hist": "use_hist"}
+
+
+def parse_policy(name):
+    """
+    Parses a policy name, as used in simulation output names: "no_data", or the policy's features joined by "_" in the
+    order of POLICY_FLAGS, e.g. "zeroes_forecast_hist".
+
+    :param name: the policy name
+    :return: dict of the policy's Simulator.run flags (use_zeroes, use_forecast, use_hist)
+    """
+    tokens = name.split("_")
+    flags = {flag: token in tokens for token, flag in POLICY_FLAGS.items()}
+    if ("_".join(token for token in POLICY_FLAGS if token in tokens) or "no_data") != name:
+        raise Exception("Unknown policy '{}', expected no_data or some of {} joined by '_' in that order, e.g. "
+                        "zeroes_forecast_hist.".format(name, ", ".join(POLICY_FLAGS)))
+    if flags["use_hist"] and not flags["use_forecast"]:
+        raise Exception("Policy '{}' extends the forecast window with historical averages, so it must use the "
+                        "forecast too.".format(name))
+    return flags
 
 
 class Simulator:
     """A simulator for modeling a simplified Automated Emissions Reduction (AER) algorithm applied to a smart plug."""
+    TRACE_COLUMNS = ["time", "fridge_temp", "fridge_on", "moer", "lbs_co2", "avg_moer_at_time"]
 
-    def __init__(self, moer_data, output_dir, num_timesteps):
+    def __init__(self, moer_data, output_dir, num_timesteps, lookahead_mins=60, decision_cache=None,
+                 hist_bucket_mins=5, seed_data=None, max_hist_extension=6, fridge_params=None, plot_format="pdf",
+                 max_plot_points=None, horizon_profile=None, trace_format="csv", import_secs=None):
         """
-        :param moer_data: a pandas dataframe containing the initial simulation data
+        :param moer_data: a pandas dataframe containing the initial simulation data, MoerFeatures precomputed from it
+                          (e.g. loaded from the feature cache), or a MoerStream to read the data incrementally (only
+                          the forecast window is held in memory, and output is written in chunks)
         :param output_dir: a path to the directory for outputting simulation artifacts
-        :param num_timesteps: the number of timesteps (data rows) to process per simulation
+        :param num_timesteps: the number of timesteps (data rows) to process per simulation, None to process all data
+                              of a MoerStream
+        :param lookahead_mins: the length of the (perfect) MOER forecast window, in minutes
+        :param decision_cache: an optional DecisionCache, to skip the decision engine for repeated problems
+        :param hist_bucket_mins: the size of the time-of-day buckets historical averages are collected in, in minutes
+        :param seed_data: an optional pandas dataframe of the MOER data immediately preceding moer_data, used only to
+                          seed the historical averages (MoerFeatures are seeded when they are computed)
+        :param max_hist_extension: the maximum number of timesteps of historical averages to extend the forecast by
+        :param fridge_params: optional dict of Refrigerator constant overrides, e.g. {"MAX_TEMP": 45}
+        :param plot_format: the file format of saved plots, "pdf" or "png"
+        :param max_plot_points: if set, plotted traces are decimated to about this many points (min/max preserving)
+        :param horizon_profile: optional multi-resolution planning horizon, a list of (span_mins, step_mins) segments
+                                (see moer_features.HORIZON_PROFILES), which must cover the whole forecast window.  The
+                                forecast window and historical averages are then planned over in steps of increasing
+                                length, and historical averages extend the window to the end of the horizon (instead of
+                                by max_hist_extension timesteps).
+        :param trace_format: the file format of the output trace, "csv" (text) or "npy" (binary records, opened
+                             memory-mapped by the Visualizer)
+        :param import_secs: optional time the process took to import its modules, measured by the entry point (e.g.
+                            refrigerator_sim.IMPORT_SECS), reported in the run summary
         """
-        self.visualizer = Visualizer(self)
-        self.fridge = Refrigerator()
-        self.historicals = {}
+        self.plot_format = plot_format
+        self.max_plot_points = max_plot_points
+        self._visualizer = None
+        self.fridge_params = fridge_params or {}
+        self.fridge = Refrigerator(**self.fridge_params)
         self.total_lbs_co2 = 0
         self.mins_per_timestep = 5  # size of one timestep in minutes
-        self.lookahead_window = int(60 / self.mins_per_timestep)  # timesteps in one hour
+        self.lookahead_window = int(lookahead_mins / self.mins_per_timestep)  # timesteps in forecast window
+        self.max_hist_extension = max_hist_extension
+        self.hist_bucket_mins = hist_bucket_mins
+        self.horizon_profile = horizon_profile
+        self.horizon_step_sizes = None
+        self.window_rows = self.lookahead_window + self.max_hist_extension  # most data rows a decision looks at
+        if horizon_profile is not None:
+            check_horizon_span(horizon_profile, lookahead_mins)
+            self.horizon_step_sizes = compute_horizon_step_sizes(horizon_profile, self.mins_per_timestep)
+            self.window_rows = int(self.horizon_step_sizes.sum())
         self.current_time = 0
+        self.engine = None
+        self.forecast_decisions = 0
+        self.zero_moer_decisions = 0
+        self.rule_decisions = 0
+        self.write_secs = 0.0
+        self.run_summary = {}
+        self.decision_cache = decision_cache
         self.output_dir = output_dir
         self.number_timesteps_to_process = num_timesteps
-        self.data = moer_data
-        self.np_moer_vector = self.data["MOER"].to_numpy()
-        self._add_synthetic_fields_to_dataframe()
-
-    def run(self, *, use_zeroes=False, use_forecast=False, use_hist=False):
+        self.seed_data = seed_data
+        self.seeded = seed_data is not None
+        if isinstance(moer_data, MoerStream):
+            # the data arrays hold the stream's buffered rows, data row timestep - data_offset is timestep
+            self.stream = moer_data
+            self.data = None
+            self.np_moer_vector = self.stream.moers
+            self.np_timeslot_ids = None
+            self.np_hist_avg_vector = self.stream.hist_avgs
+            self.np_hist_datapoints = self.stream.hist_datapoints
+        else:
+            self.stream = None
+            if isinstance(moer_data, MoerFeatures):
+                if moer_data.hist_bucket_mins != hist_bucket_mins:
+                    raise Exception("MoerFeatures were computed with {} minute buckets, not {}.".format(
+                        moer_data.hist_bucket_mins, hist_bucket_mins))
+                if seed_data is not None:
+                    raise Exception("MoerFeatures are seeded when they are computed, seed_data can't be applied.")
+                self.data = None
+                features = moer_data
+                self.seeded = features.seeded
+            else:
+                self.data = moer_data
+                features = MoerFeatures.compute(self.data, hist_bucket_mins, self.mins_per_timestep, seed_data)
+                self._add_synthetic_fields_to_dataframe(features)
+            self.np_moer_vector = features.moers
+            self.np_timeslot_ids = features.timeslot_ids
+            self.np_hist_avg_vector = features.hist_avgs
+            self.np_hist_datapoints = features.hist_datapoints
+        self.data_offset = 0
+        self.first_timestep = 0  # the timestep a run starts (or resumes) at
+        self.timesteps_processed = 0
+        self.output_filename = None
+        self.trace = {}
+        self.trace_format = trace_format
+        self.import_secs = import_secs
+        self.trace_writer = None
+        self.trace_length = 0
+        self.trace_rows_written = 0
+
+    def run(self, *, use_zeroes=False, use_forecast=False, use_hist=False, engine="lp", plot=True, metrics=False,
+            trace_steps=False, checkpoint_every=None, checkpoint_path=None, resume_from=None):
         """
         Top-level simulation method. Makes a decision for fridge on/off at each timestep of the simulation,
-        and writes resulting data to .csv file, then invokes visualizer to create and save a plot of the
-        resulting data.
+        and writes resulting data to a .csv (or .npy) file, then invokes visualizer to create and save a plot of the
+        resulting data.  A summary of the run is left in self.run_summary.
 
         :param use_zeroes: whether to make default decision to turn on (if possible) in timesteps with a MOER value of 0
-        :param use_forecast: whether to incorporate the 1-hr forecast window into decision making.
+        :param use_forecast: whether to incorporate the forecast window into decision making.
         :param use_hist: whether to extend the forecast window using historical averages as they become available.
+        :param engine: the decision engine used to optimize the forecast window, "lp" (PuLP/CBC), "highs" (persistent
+                       in-process HiGHS model) or "dp" (exact dynamic programming, much faster for long windows)
+        :param plot: whether to plot the results once the simulation is done
+        :param metrics: whether to time the phases of the run (setup, timesteps, decision engine, output, plotting) and
+                        write them, with decision counters, to a JSON summary next to the output csv (*_metrics.json)
+        :param trace_steps: whether to also write the timings of every timestep to a csv (*_steps.csv), implies metrics
+        :param checkpoint_every: if set, the state of the simulation (and the trace written so far) is saved every this
+                                 many timesteps, so that the run can be resumed if it dies
+        :param checkpoint_path: the file checkpoints are saved to, overwritten by every checkpoint; defaults to the
+                                output file's name with a _checkpoint.pkl suffix
+        :param resume_from: path of a checkpoint to resume the run from, instead of starting from the first timestep.
+                            The run may use a different policy, engine or horizon than the checkpointed run (forking a
+                            what-if run from the common prefix), but must simulate the same data and fridge.  The
+                            checkpointed trace is copied to the new output file if the output file is different.
         """
         if use_hist and not use_forecast:
             raise Exception("If historical averages are being used, forecast window must be too.")
 
         start_time = time.time()
+        run_metrics = RunMetrics(trace_steps) if metrics or trace_steps else None
+        if run_metrics is not None:
+            run_metrics.start_phase()
         output_filename = self._get_output_filename(use_zeroes, use_forecast, use_hist)
-        self._prepare_new_simulation(output_filename)
-
-        for timestep in range(self.number_timesteps_to_process):
+        self._prepare_new_simulation(output_filename, engine)
+        if resume_from is not None:
+            self._restore_checkpoint(resume_from)
+        if checkpoint_every is not None and checkpoint_path is None:
+            checkpoint_path = os.path.splitext(output_filename)[0] + "_checkpoint.pkl"
+        if run_metrics is not None:
+            run_metrics.end_phase("prepare")
+            run_metrics.start_phase()
+
+        for timestep in self._data_rows():
+            if run_metrics is not None:
+                run_metrics.start_step()
             made_decision = False
             # the expected temp if the fridge continues in its current state (on/off) for another timestep
             expected_temp = self.fridge.expected_temp(self.current_time + self.mins_per_timestep)
 
             if use_zeroes:
                 if self.np_moer_vector[timestep] == 0:
-                    if expected_temp > self.fridge.MIN_TEMP:
-                        self.fridge.turn_on()  # if the MOERS are free and the fridge isn't too cold, turn on!
-                    else:
-                        self.fridge.turn_off()  # we HAVE to turn off, getting too cold
+                    self.fridge.apply_zero_moer_rule(expected_temp)
                     made_decision = True
+                    decision_path = "zero_moer"
+                    self.zero_moer_decisions += 1
 
             if use_forecast and not made_decision:
-                decision = self._get_next_decision_with_lp(timestep, use_historicals=use_hist)  # <-- all the action
-                if decision == 0:
-                    self.fridge.turn_off()
-                else:
-                    self.fridge.turn_on()
+                decision = self._get_next_decision(timestep, use_historicals=use_hist)  # <-- all the action
+                self.fridge.set_status(decision)
                 made_decision = True
+                decision_path = "forecast"
 
             if not made_decision:  # case using no data at all
-                if expected_temp <= self.fridge.MIN_TEMP:
-                    self.fridge.turn_off()
-                elif expected_temp >= self.fridge.MAX_TEMP:
-                    self.fridge.turn_on()
+                self.fridge.apply_thermostat_rule(expected_temp)
+                decision_path = "rule"
+                self.rule_decisions += 1
 
-            # write csv row for this timestep
-            self._generate_output_row(timestep)
+            # record output row for this timestep
+            self._record_output_row(timestep)
 
             # update simulator state for next timestep
             self.fridge.current_temp = self.fridge.expected_temp(self.current_time + self.mins_per_timestep)
             self.current_time += self.mins_per_timestep
             self.fridge.current_timestamp = self.current_time
-
-            # update historicals dictionary and dataframe row (even if not using them, in case plot_moer_avgs needs)
-            self._update_historical_avgs(timestep)
-
-        self.outfile.close()
+            if run_metrics is not None:
+                run_metrics.end_step(self.timesteps_processed - 1, decision_path, self.fridge.on, self.engine)
+            if checkpoint_every is not None and self.timesteps_processed % checkpoint_every == 0:
+                self._save_checkpoint(checkpoint_path, engine, use_zeroes, use_forecast, use_hist)
+
+        if run_metrics is not None:
+            run_metrics.end_phase("steps")
+        self._write_output(output_filename)
+        run_time = time.time() - start_time
+        self.run_summary = {"output": output_filename,
+                            "total_lbs_co2": self.total_lbs_co2,
+                            "run_time_secs": run_time,
+                            "timesteps": self.timesteps_processed,
+                            "forecast_decisions": self.forecast_decisions,
+                            "zero_moer_decisions": self.zero_moer_decisions,
+                            "rule_decisions": self.rule_decisions,
+                            "decisions_per_sec": self.timesteps_processed / run_time if run_time else 0,
+                            "import_secs": self.import_secs}
         self._print_co2_emissions()
         self._print_sim_run_time(start_time, output_filename.lstrip("sim_output_"))
-        print("\nGenerating matplotlib plots (~30s)...")
-        self.visualizer.plot(output_filename)
-        return output_filename  # to link the output with this run, used by plot_avg_moers
+        if self.decision_cache is not None:
+            self._print_decision_cache_stats()
+            self.decision_cache.save()
+        if plot:
+            print("\nGenerating matplotlib plots...")
+            if run_metrics is not None:
+                run_metrics.start_phase()
+            self.visualizer.plot(output_filename)
+            if run_metrics is not None:
+                run_metrics.end_phase("plot")
+        if run_metrics is not None:
+            self._write_run_metrics(run_metrics, output_filename)
+        return output_filename
+
+    def _write_run_metrics(self, run_metrics, output_filename):
+        """
+        Writes the timers and counters of a run next to its output csv: a JSON summary (*_metrics.json) and, if steps
+        were traced, the per-timestep timings (*_steps.csv).
+        """
+        output_base = os.path.splitext(output_filename)[0]
+        summary_path = output_base + "_metrics.json"
+        step_trace_path = output_base + "_steps.csv" if run_metrics.trace_steps else None
+        run_metrics.write(self, summary_path, step_trace_path)
+        print("Run metrics written to", summary_path)
+        if step_trace_path is not None:
+            print("Per-timestep trace written to", step_trace_path)
+
+    @property
+    def visualizer(self):
+        """The Visualizer of the simulation, created (and matplotlib imported) when first used, so headless runs never
+        import matplotlib."""
+        if self._visualizer is None:
+            from visualizer import Visualizer
+            self._visualizer = Visualizer(self, self.plot_format, self.max_plot_points)
+        return self._visualizer
 
     def plot_avg_moers(self):
         """Generates a plot of the average MOER data for a given time of day, across duration of simulation."""
-        output_filename = self.run()  # don't care about the actual simulation here
-        self.visualizer.plot_avg_moers(output_filename)
+        if self.stream is not None:
+            raise Exception("Average MOERs can't be plotted from streamed data, plot a simulation's output instead.")
+        times = np.arange(self.number_timesteps_to_process) * self.mins_per_timestep
+        self.visualizer.plot_avg_moers(times, self.np_hist_avg_vector[:self.number_timesteps_to_process])
         return
 
-    def _get_next_decision_with_lp(self, start_timestep, use_historicals=False):
+    def _data_rows(self):
+        """
+        Generates the data row index of every timestep to simulate.  For streamed data, the stream is advanced so that
+        each timestep's forecast window is buffered, and the data arrays are rebound to the stream's buffer.
+
+        :return: generator of data row indices (equal to the timestep for in-memory data)
+        """
+        if self.stream is None:
+            for timestep in range(self.first_timestep, self.number_timesteps_to_process):
+                self.timesteps_processed = timestep + 1
+                yield timestep
+            return
+
+        timestep = self.first_timestep
+        while self.number_timesteps_to_process is None or timestep < self.number_timesteps_to_process:
+            if not self.stream.advance(timestep, self.window_rows):
+                return
+            self.np_moer_vector = self.stream.moers
+            self.np_hist_avg_vector = self.stream.hist_avgs
+            self.np_hist_datapoints = self.stream.hist_datapoints
+            self.data_offset = self.stream.offset
+            self.timesteps_processed = timestep + 1
+            yield timestep - self.data_offset
+            timestep += 1
+
+    def _get_next_decision(self, start_timestep, use_historicals=False):
         """
         Generates and returns the decision that the refrigerator should make (be off or on) for this timestep.
-        The decision is made by solving a linear programming problem that seeks to minimize CO2 production in the
+        The decision is made by the simulation's decision engine, which seeks to minimize CO2 production in the
         forecast window, subject to the temperature constraints in which the refrigerator must remain.
         The first step of the optimal solution is returned.
 
-        :param start_timestep: the index of this timestep in the simulation
+        :param start_timestep: the data row index of this timestep in the simulation
         :param use_historicals: whether or not to attempt to extend the forecast window using historical averages
         :return: 0 if the refrigerator should be off, 1 if the refrigerator should be on
         """
-        model = LpProblem("CO2_Minimization_Problem", LpMinimize)
-        moer_vector = self.np_moer_vector[start_timestep: start_timestep + self.lookahead_window]
+        moer_vector = self._get_forecast(start_timestep)
+        moer_vector_hist_avg = np.array([])
 
         if use_historicals:
             # extend the forecast window using historical averages as predicted MOERs
             # extend the forecast window in proportion to the quality of the average (number datapoints used to calc)
-            timeslotID = self.data['timeslotID'][start_timestep]
-            if timeslotID in self.historicals:
-                num_datapoints_in_avg = self.historicals[timeslotID][1]
-            else:
-                num_datapoints_in_avg = 0
-
-            hist_lookahead_window = min(num_datapoints_in_avg, 6)  # computationally feasible
-
-            moer_vector_hist_avg = np.array(self.data['hist_avg_moer_at_time']
-                                            [start_timestep + self.lookahead_window:
-                                             start_timestep + self.lookahead_window + hist_lookahead_window])
-            moer_vector = np.concatenate((moer_vector, moer_vector_hist_avg))
-
-        variable_suffixes = [str(i) for i in range(moer_vector.size)]
-        # s for status (on/off)
-        decision_variables = LpVariable.matrix("s", variable_suffixes, cat="Binary")
-        status_vector = np.array(decision_variables)
-
-        # Set up objective function
-        obj_func = lpSum(status_vector * moer_vector)
-        model += obj_func
-
-        # Set up constraints
-        temp_variables = LpVariable.matrix("t", variable_suffixes, cat="Continuous")
-        for i in range(moer_vector.size - 1):
-            model += temp_variables[i + 1] == temp_variables[i] + \
-                     self.fridge.COOLING_RATE * self.mins_per_timestep * status_vector[i] + \
-                     self.fridge.WARMING_RATE * self.mins_per_timestep * (1 - status_vector[i])
-            model += temp_variables[i + 1] <= self.fridge.MAX_TEMP
-            model += temp_variables[i + 1] >= self.fridge.MIN_TEMP
-        model += temp_variables[0] == self.fridge.current_temp  # starting temp of fridge
+            num_datapoints_in_avg = self.np_hist_datapoints[start_timestep]
+            hist_lookahead_window = hist_extension_length(num_datapoints_in_avg, self.max_hist_extension)
+            if self.horizon_step_sizes is not None:
+                # multi-resolution horizons extend to their end as soon as there is any history
+                hist_lookahead_window = self.window_rows - self.lookahead_window if num_datapoints_in_avg > 0 else 0
+
+            moer_vector_hist_avg = self.np_hist_avg_vector[start_timestep + self.lookahead_window:
+                                                           start_timestep + self.lookahead_window +
+                                                           hist_lookahead_window]
+
+        self.forecast_decisions += 1
+        if self.decision_cache is None:
+            return self._decide(np.concatenate((moer_vector, moer_vector_hist_avg)))
+
+        cache_key = self.decision_cache.make_key(self.fridge.current_temp, moer_vector, moer_vector_hist_avg)
+        decision = self.decision_cache.get(cache_key)
+        if decision is None:
+            decision = self._decide(np.concatenate((moer_vector, moer_vector_hist_avg)))
+            self.decision_cache.put(cache_key, decision)
+        return decision
+
+    def _get_forecast(self, start_timestep):
+        """
+        :param start_timestep: the data row index of this timestep in the simulation
+        :return: numpy array of the forecast MOERs of the window starting at this timestep (a perfect forecast: the
+                 actual MOERs)
+        """
+        return self.np_moer_vector[start_timestep: start_timestep + self.lookahead_window]
 
-        model.solve(PULP_CBC_CMD(msg=False))
+    def _decide(self, window_moers):
+        """
+        Runs the decision engine on a window of predicted MOERs, averaged over the steps of the multi-resolution
+        horizon if there is one.
 
-        return model.variablesDict()['s_0'].value()
+        :param window_moers: numpy array of (forecast or predicted) MOERs, one per timestep of the window
+        :return: 0 if the refrigerator should be off, 1 if the refrigerator should be on
+        """
+        if self.horizon_step_sizes is None:
+            return self.engine.decide(window_moers, self.fridge.current_temp)
+        step_moers, step_sizes = aggregate_horizon(window_moers, self.horizon_step_sizes)
+        return self.engine.decide(step_moers, self.fridge.current_temp, step_sizes)
 
-    def _add_synthetic_fields_to_dataframe(self):
+    def _add_synthetic_fields_to_dataframe(self, features):
         """
         Adds several calculated fields to the initial data table (self.data) created from the .csv file:
-            - timeslotID: the unique time of day of this timestep, encoded in hhmm (hour hour minute minute) format
-            - hist_avg_moer_at_time: the running averge MOER for this particular time of day, as of this point in the
-                                    simulation
-        """
-        # add "timeslotID" - to tie a timestamp to its relative time of day
-        process_timestamp = lambda timestamp: "".join(timestamp.split(" ")[1].split(":")[:2])
-        self.data['timeslotID'] = self.data['timestamp'].apply(process_timestamp)
+            - timeslotID: the index of the time-of-day bucket of this timestep (bucket size self.hist_bucket_mins)
+            - hist_avg_moer_at_time: the average MOER for this timestep's bucket, over all data at least one day old
+            - hist_datapoints: the number of MOERs in hist_avg_moer_at_time
 
-        # create an empty historical avg column
-        self.data['hist_avg_moer_at_time'] = 0
+        :param features: the MoerFeatures computed from self.data
+        """
+        self.data['timeslotID'] = features.timeslot_ids
+        self.data['hist_avg_moer_at_time'] = features.hist_avgs
+        self.data['hist_datapoints'] = features.hist_datapoints
         return
 
     def _get_output_filename(self, use_zeroes, use_forecast, use_hist):
@@ -174,70 +382,188 @@ class Simulator:
             output_suffix += '_hist'
         if output_suffix == '':
             output_suffix = '_no_data'
-        return self.output_dir.rstrip("/") + "/" + "sim_output" + output_suffix + ".csv"
+        return self.output_dir.rstrip("/") + "/" + "sim_output" + output_suffix + "." + self.trace_format
 
-    def _prepare_new_simulation(self, output_filename):
+    def _prepare_new_simulation(self, output_filename, engine="lp"):
         """
         Resets dynamic fields and collections in Simulator object in preparation for a fresh simulation.
 
         :param output_filename: The name of the file that data will be written to during this simulation.
+        :param engine: The name of the decision engine to use during this simulation.
         """
-        self.fridge = Refrigerator()
-        self.historicals = {}
+        self.fridge = Refrigerator(**self.fridge_params)
+        self.engine = create_engine(engine, self.fridge, self.mins_per_timestep)
+        self.forecast_decisions = 0
+        self.zero_moer_decisions = 0
+        self.rule_decisions = 0
+        self.write_secs = 0.0
+        if self.decision_cache is not None:
+            horizon = None if self.horizon_profile is None else tuple(map(tuple, self.horizon_profile))
+            self.decision_cache.set_problem((engine, self.mins_per_timestep, self.fridge.MIN_TEMP,
+                                             self.fridge.MAX_TEMP, self.fridge.WARMING_RATE, self.fridge.COOLING_RATE,
+                                             horizon))
+            self.decision_cache.reset_stats()
+        self.output_filename = output_filename
         self.current_time = 0
         self.total_lbs_co2 = 0
-        self.data['hist_avg_moer_at_time'] = 0
-        self.outfile = open(output_filename, 'w')
-        # write CSV headers
-        self.outfile.write("time,fridge_temp,fridge_on,moer,lbs_co2,avg_moer_at_time\n")
+        self.first_timestep = 0
+        self.timesteps_processed = 0
+        if self.stream is not None:
+            self.stream.start(self.hist_bucket_mins, MINS_PER_DAY // self.mins_per_timestep, self.seed_data)
+            self.stream.advance(0, self.window_rows)
+            self.np_moer_vector = self.stream.moers
+            num_rows = self.stream.chunk_rows
+        else:
+            num_rows = self.number_timesteps_to_process
+        # preallocated output columns, filled in one row per timestep and written out in bulk when full (at the end of
+        # the simulation, for in-memory data)
+        self.trace_length = 0
+        self.trace_rows_written = 0
+        self.trace = {"time": np.zeros(num_rows, dtype=np.int64),
+                      "fridge_temp": np.zeros(num_rows),
+                      "fridge_on": np.zeros(num_rows, dtype=bool),
+                      "moer": np.zeros(num_rows, dtype=self.np_moer_vector.dtype),
+                      "lbs_co2": np.zeros(num_rows),
+                      "avg_moer_at_time": np.zeros(num_rows)}
+        self.trace_writer = None
+        if self.trace_format == "npy":
+            self.trace_writer = NpyTraceWriter(output_filename, [(column, self.trace[column].dtype)
+                                                                 for column in self.TRACE_COLUMNS])
         print("\nRunning simulation ({})...".format(output_filename.lstrip("sim_output_")))
 
-    def _update_historical_avgs(self, timestep):
-        """
-        Incorporates the MOER data at this timestep into the running average MOER for all corresponding (same
-        time of day) timesteps.
-
-        :param timestep: the index of the current timestep in the simulation data
-        """
-        timeslotID = self.data.iloc[timestep]['timeslotID']
-        moer = self.data.iloc[timestep]['MOER']
-        avg = moer
-        count = 1
-        if timeslotID in self.historicals:
-            old_avg = self.historicals[timeslotID][0]
-            count = self.historicals[timeslotID][1]
-            avg = (count * old_avg + moer) / (count + 1)
-            count += 1
-        # Update running average for this time of day
-        self.historicals[timeslotID] = (avg, count)
-
-        # Update new historical average to NEXT equivalent timeslot.  As long as the forecast window doesn't exceed 288
-        # timesteps (currently maxing out at 18), then we only ever have to update the one value at a time.
-        # Future values set at this time would be overwritten anyway.  Past values don't matter.
-        timesteps_per_day = 288
-        next_corresponding_timeslot = timestep + timesteps_per_day
-        if next_corresponding_timeslot < self.number_timesteps_to_process:
-            self.data.iloc[next_corresponding_timeslot, self.data.columns.get_loc('hist_avg_moer_at_time')] = avg
+    def _get_checkpoint_problem(self):
+        """
+        :return: a description of everything that must be the same for a run to resume from another run's checkpoint
+        """
+        return {"mins_per_timestep": self.mins_per_timestep,
+                "fridge_params": self.fridge_params,
+                "hist_bucket_mins": self.hist_bucket_mins,
+                "seeded": self.seeded,
+                "streamed": self.stream is not None,
+                "data_rows": None if self.stream is not None else len(self.np_moer_vector),
+                "trace_format": self.trace_format}
+
+    def _save_checkpoint(self, checkpoint_path, engine, use_zeroes, use_forecast, use_hist):
+        """
+        Saves the state of the simulation after the timesteps processed so far: the fridge, the running totals and
+        counters, the stream's position and the position in the output file.  The recorded trace rows are written out
+        first, so that the output file holds the trace up to the checkpoint.  The checkpoint file is replaced
+        atomically, so an interrupted save leaves the previous checkpoint intact.
+
+        :param checkpoint_path: the file to save the checkpoint to
+        :param engine: the name of the run's decision engine
+        :param use_zeroes: the run's use_zeroes policy flag
+        :param use_forecast: the run's use_forecast policy flag
+        :param use_hist: the run's use_hist policy flag
+        """
+        self._write_output(self.output_filename)
+        checkpoint = {"problem": self._get_checkpoint_problem(),
+                      "run": {"engine": engine, "use_zeroes": use_zeroes, "use_forecast": use_forecast,
+                              "use_hist": use_hist, "lookahead_window": self.lookahead_window,
+                              "max_hist_extension": self.max_hist_extension, "horizon_profile": self.horizon_profile},
+                      "timesteps_processed": self.timesteps_processed,
+                      "fridge": {"on": self.fridge.on, "current_temp": self.fridge.current_temp,
+                                 "current_timestamp": self.fridge.current_timestamp},
+                      "current_time": self.current_time,
+                      "total_lbs_co2": self.total_lbs_co2,
+                      "forecast_decisions": self.forecast_decisions,
+                      "zero_moer_decisions": self.zero_moer_decisions,
+                      "rule_decisions": self.rule_decisions,
+                      "stream": self.stream.get_state() if self.stream is not None else None,
+                      "output_filename": self.output_filename,
+                      "trace_rows_written": self.trace_rows_written,
+                      "trace_bytes": os.path.getsize(self.output_filename)}
+        with open(checkpoint_path + ".tmp", 'wb') as checkpoint_file:
+            pickle.dump(checkpoint, checkpoint_file)
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
         return
 
-    def _generate_output_row(self, timestep):
+    def _restore_checkpoint(self, checkpoint_path):
         """
-        Writes a single row of data to output csv file.
+        Restores the state of the simulation from a checkpoint saved by _save_checkpoint, so that the run continues
+        after the checkpoint's last timestep.  The output file is set up to hold the checkpointed trace: it is copied
+        from the checkpointed run's output file if that is a different file, and any rows after the checkpoint are
+        dropped.
+
+        :param checkpoint_path: the checkpoint file to resume from
+        """
+        with open(checkpoint_path, 'rb') as checkpoint_file:
+            checkpoint = pickle.load(checkpoint_file)
+        problem = self._get_checkpoint_problem()
+        for name, value in checkpoint["problem"].items():
+            if problem.get(name) != value:
+                raise Exception("Can't resume from checkpoint {}, it was taken with {} = {} (not {}).".format(
+                    checkpoint_path, name, value, problem.get(name)))
+
+        if os.path.abspath(checkpoint["output_filename"]) != os.path.abspath(self.output_filename):
+            shutil.copyfile(checkpoint["output_filename"], self.output_filename)
+        if self.trace_writer is not None:
+            self.trace_writer.resume(checkpoint["trace_rows_written"])
+        else:
+            os.truncate(self.output_filename, checkpoint["trace_bytes"])
+        self.trace_rows_written = checkpoint["trace_rows_written"]
+
+        for name, value in checkpoint["fridge"].items():
+            setattr(self.fridge, name, value)
+        self.current_time = checkpoint["current_time"]
+        self.total_lbs_co2 = checkpoint["total_lbs_co2"]
+        self.forecast_decisions = checkpoint["forecast_decisions"]
+        self.zero_moer_decisions = checkpoint["zero_moer_decisions"]
+        self.rule_decisions = checkpoint["rule_decisions"]
+        self.first_timestep = self.timesteps_processed = checkpoint["timesteps_processed"]
+        if self.stream is not None:
+            self.stream.set_state(checkpoint["stream"])
+        print("Resuming from checkpoint {} after timestep {}.".format(checkpoint_path, self.first_timestep))
+        return
+
+    def _record_output_row(self, timestep):
+        """
+        Records a single row of output data for this timestep in the trace arrays.
 
         :param timestep: the current timestep (data row index)
         """
-        moer = self.data.iloc[timestep]['MOER']
+        moer = self.np_moer_vector[timestep]
         if not self.fridge.on:
             lbs_co2 = 0
         else:
             lbs_co2 = self._lbs_co2_from_moer(moer)
         self.total_lbs_co2 += lbs_co2
-        hist_avg_moer = self.data.iloc[timestep]['hist_avg_moer_at_time']
 
-        row_data = [self.current_time, round(self.fridge.current_temp, 2), self.fridge.on, moer, lbs_co2,
-                    hist_avg_moer]
-        str_row_data = [str(field) for field in row_data]
-        self.outfile.write(",".join(str_row_data) + "\n")
+        row = self.trace_length
+        self.trace["time"][row] = self.current_time
+        self.trace["fridge_temp"][row] = self.fridge.current_temp
+        self.trace["fridge_on"][row] = self.fridge.on
+        self.trace["moer"][row] = moer
+        self.trace["lbs_co2"][row] = lbs_co2
+        self.trace["avg_moer_at_time"][row] = self.np_hist_avg_vector[timestep]
+        self.trace_length += 1
+        if self.trace_length == len(self.trace["time"]) and self.stream is not None:
+            self._write_output(self.output_filename)
+        return
+
+    def _write_output(self, output_filename):
+        """
+        Writes the recorded trace rows to the output file in one go, appending to the rows written before (if any).
+
+        :param output_filename: The name of the file to write the data to.
+        """
+        write_start = time.perf_counter()
+        if self.trace_writer is not None:
+            records = np.empty(self.trace_length, dtype=self.trace_writer.dtype)
+            for column in self.TRACE_COLUMNS:
+                records[column] = self.trace[column][:self.trace_length]
+            records["fridge_temp"] = records["fridge_temp"].round(2)
+            self.trace_writer.append(records)
+        else:
+            import pandas as pd  # deferred, only csv traces need pandas
+            output = pd.DataFrame({column: values[:self.trace_length] for column, values in self.trace.items()},
+                                  columns=self.TRACE_COLUMNS)
+            output["fridge_temp"] = output["fridge_temp"].round(2)
+            first_write = self.trace_rows_written == 0
+            output.to_csv(output_filename, index=False, mode='w' if first_write else 'a', header=first_write)
+        self.trace_rows_written += self.trace_length
+        self.trace_length = 0
+        self.write_secs += time.perf_counter() - write_start
         return
 
     def _lbs_co2_from_moer(self, moer):
@@ -247,15 +573,20 @@ class Simulator:
         :param moer: the MOER from which to calculate lbs CO2
         :return: the lbs CO2, rounded to 8 decimal places
         """
-        megawatts_per_watt = 1 / 1000000
-        hours_per_minute = 1 / 60
-        return round(moer * (self.fridge.WATTAGE * megawatts_per_watt) * (self.mins_per_timestep * hours_per_minute), 8)
+        return self.fridge.lbs_co2_from_moer(moer, self.mins_per_timestep)
 
     def _print_co2_emissions(self):
         print("=" * 50)
         print("Total refrigerator run time: ", self.current_time, " mins")
         print("Total lbs CO2 emitted: ", self.total_lbs_co2)
 
+    def _print_decision_cache_stats(self):
+        cache = self.decision_cache
+        lookups = cache.hits + cache.misses
+        hit_rate = round(100 * cache.hits / lookups, 1) if lookups else 0
+        print("Decision cache: {} hits, {} misses ({}% hit rate), {} evictions, {} entries".format(
+            cache.hits, cache.misses, hit_rate, cache.evictions, len(cache.entries)))
+
     def _print_sim_run_time(self, start_time, sim_id):
         """
         Prints a formatted message indicating time elapsed since start_time for the simulation identified by sim_id.
@@ -268,3 +599,5 @@ class Simulator:
         minutes = int(total_seconds // 60)
         seconds = total_seconds % 60
         print("Simulation '{}' duration: {} min {} sec".format(sim_id, minutes, seconds))
+        if self.import_secs is not None:
+            print("Import time: {} sec".format(round(self.import_secs, 3)))
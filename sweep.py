@@ -0,0 +1,188 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import itertools
+import json
+import os
+import time
+from feature_cache import load_moer_features
+from moer_features import check_horizon_span, parse_horizon_profile
+from refrigerator_sim import load_moer_data
+from simulator import Simulator, parse_policy
+from trace_files import TRACE_FORMATS
+
+# Grid spec keys that configure the Simulator (with their defaults), and the ones that configure Simulator.run
+SIMULATOR_PARAMS = {"lookahead_mins": 60, "max_hist_extension": 6, "hist_bucket_mins": 5, "seed_first_day": False,
+                    "horizon": None, "timesteps": "all"}
+RUN_PARAMS = {"policy": "zeroes_forecast_hist", "engine": "dp"}
+
+# MOER data of the current worker process, loaded once per worker by _load_worker_data
+_worker_data = {}
+
+
+def parse_args():
+    """ Parses command line arguments """
+    parser = argparse.ArgumentParser(description='Run a grid of simulation scenarios in parallel.')
+    parser.add_argument('grid', help='Path to a JSON grid spec.  Each key maps to a list of values (or a single value) '
+                                     'to sweep: policy, engine, lookahead_mins, max_hist_extension, '
+                                     'hist_bucket_mins, seed_first_day, horizon, timesteps, and "fridge", a mapping of '
+                                     'Refrigerator constants (e.g. MAX_TEMP) to lists of values.')
+    parser.add_argument('--data_path', action='store', default='MOER_data/MOERS.csv', help='Path to dataset.')
+    parser.add_argument('--output_dir', action='store', default='./output_data/sweep/',
+                        help='Directory for the summary table and per-scenario traces.')
+    parser.add_argument('--workers', action='store', type=int, default=os.cpu_count(),
+                        help='Number of worker processes, defaults to the number of cores.')
+    parser.add_argument('--plot', action='store_true', default=False, help='Also plot every scenario (slow).')
+    parser.add_argument('--trace_format', action='store', default='csv', choices=TRACE_FORMATS,
+                        help='File format of the per-scenario traces: csv, or npy (binary, no text formatting or '
+                             'parsing), defaults to csv.')
+    parser.add_argument('--feature_cache', action='store', default=None,
+                        help='Directory of a feature cache to load the dataset\'s features from (and store them in), '
+                             'instead of computing them for every scenario.')
+    parser.add_argument('--fork_from', action='store', default=None,
+                        help='Checkpoint (see refrigerator_sim.py --checkpoint_every) to resume every scenario from, '
+                             'so that the simulated prefix is shared instead of simulated again.  Scenarios may vary '
+                             'the policy, engine, lookahead and horizon, but not the fridge or historical averages.')
+    return parser.parse_args()
+
+
+def expand_grid(grid):
+    """
+    Expands a grid spec into the list of all scenarios it describes (the cartesian product of all swept values).
+
+    :param grid: dict of parameter name to a list of values (or a single value); the "fridge" entry is a dict of
+                 Refrigerator constant name to a list of values (or a single value)
+    :return: list of scenario dicts, each with a single value for every parameter and a "fridge" dict
+    """
+    unknown = set(grid) - set(SIMULATOR_PARAMS) - set(RUN_PARAMS) - {"fridge"}
+    if unknown:
+        raise Exception("Unknown sweep parameters: {}".format(", ".join(sorted(unknown))))
+
+    axes = dict(SIMULATOR_PARAMS, **RUN_PARAMS)
+    axes.update({name: values for name, values in grid.items() if name != "fridge"})
+    axes.update({"fridge." + name: values for name, values in grid.get("fridge", {}).items()})
+    names = list(axes)
+    value_lists = [values if isinstance(values, list) else [values] for values in axes.values()]
+
+    scenarios = []
+    for values in itertools.product(*value_lists):
+        scenario = {"fridge": {}}
+        for name, value in zip(names, values):
+            if name.startswith("fridge."):
+                scenario["fridge"][name[len("fridge."):]] = value
+            else:
+                scenario[name] = value
+        # reject invalid policies and horizons before any worker starts
+        parse_policy(scenario["policy"])
+        if scenario["horizon"]:
+            check_horizon_span(parse_horizon_profile(scenario["horizon"]), scenario["lookahead_mins"])
+        scenario["name"] = "scenario_{:03d}".format(len(scenarios))
+        scenarios.append(scenario)
+    return scenarios
+
+
+def run_scenario(scenario, output_dir, plot=False, trace_format="csv", fork_from=None):
+    """
+    Runs a single scenario with its own, freshly created Simulator.  Meant to be run in a worker process.
+
+    :param scenario: a scenario dict, as created by expand_grid
+    :param output_dir: the sweep output directory; the scenario's trace goes into a subdirectory named after it
+    :param plot: whether to plot the scenario's results
+    :param trace_format: the file format of the scenario's trace, one of trace_files.TRACE_FORMATS
+    :param fork_from: optional path of a checkpoint to resume the scenario from
+    :return: a summary row (dict) for the scenario
+    """
+    scenario_dir = os.path.join(output_dir, scenario["name"])
+    os.makedirs(scenario_dir, exist_ok=True)
+    policy_flags = parse_policy(scenario["policy"])
+    horizon_profile = parse_horizon_profile(scenario["horizon"]) if scenario["horizon"] else None
+    if _worker_data["feature_cache"] is not None:
+        moer_data = _load_worker_features(scenario["hist_bucket_mins"], scenario["seed_first_day"])
+        seed_data = None  # the features are already seeded
+    else:
+        initial_historical_data, sim_moer_data = _worker_data["initial"], _worker_data["sim"]
+        moer_data = sim_moer_data.copy()
+        seed_data = initial_historical_data if scenario["seed_first_day"] else None
+    timesteps = len(moer_data) if scenario["timesteps"] == "all" else int(scenario["timesteps"])
+
+    with contextlib.redirect_stdout(io.StringIO()):  # keep the workers' progress messages out of the sweep output
+        simulator = Simulator(moer_data, scenario_dir, timesteps,
+                              lookahead_mins=scenario["lookahead_mins"],
+                              hist_bucket_mins=scenario["hist_bucket_mins"],
+                              seed_data=seed_data,
+                              max_hist_extension=scenario["max_hist_extension"],
+                              fridge_params=scenario["fridge"],
+                              horizon_profile=horizon_profile, trace_format=trace_format)
+        simulator.run(engine=scenario["engine"], plot=plot, resume_from=fork_from, **policy_flags)
+
+    row = {"name": scenario["name"], "policy": scenario["policy"], "engine": scenario["engine"]}
+    row.update({name: value for name, value in scenario.items() if name not in row and name != "fridge"})
+    row.update({"fridge." + name: value for name, value in scenario["fridge"].items()})
+    row.update(simulator.run_summary)
+    return row
+
+
+def run_sweep(grid, data_path, output_dir, workers=None, plot=False, trace_format="csv", fork_from=None,
+              feature_cache=None):
+    """
+    Runs every scenario of a grid spec across a pool of worker processes, and writes a summary table of the results
+    (sweep_summary.csv) to the output directory.
+
+    :param grid: a grid spec dict (see expand_grid)
+    :param data_path: path to the MOER dataset
+    :param output_dir: directory for the summary table and the per-scenario traces
+    :param workers: number of worker processes, defaults to the number of cores
+    :param plot: whether to plot every scenario
+    :param trace_format: the file format of the per-scenario traces, one of trace_files.TRACE_FORMATS
+    :param fork_from: optional path of a checkpoint to resume every scenario from
+    :param feature_cache: optional directory of a feature cache to load the dataset's features from
+    :return: the summary table, as a pandas dataframe
+    """
+    scenarios = expand_grid(grid)
+    os.makedirs(output_dir, exist_ok=True)
+    print("Running {} scenarios on {} workers...".format(len(scenarios), workers or os.cpu_count()))
+
+    start_time = time.time()
+    if feature_cache is not None:
+        # compute any missing features once, up front, so that the workers only load them and never parse the dataset
+        for hist_bucket_mins, seed_first_day in sorted({(scenario["hist_bucket_mins"], scenario["seed_first_day"])
+                                                        for scenario in scenarios}):
+            load_moer_features(data_path, feature_cache, hist_bucket_mins, seed_first_day)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_worker_data,
+                             initargs=(data_path, feature_cache)) as pool:
+        rows = list(pool.map(run_scenario, scenarios, itertools.repeat(output_dir), itertools.repeat(plot),
+                             itertools.repeat(trace_format), itertools.repeat(fork_from)))
+
+    import pandas as pd  # deferred, so that loading this module (e.g. in a worker) doesn't import pandas
+    summary = pd.DataFrame(rows)
+    summary.to_csv(os.path.join(output_dir, "sweep_summary.csv"), index=False)
+    print(summary.drop(columns=["output"]).to_string(index=False))
+    print("Sweep duration: {} sec".format(round(time.time() - start_time, 2)))
+    return summary
+
+
+def _load_worker_data(data_path, feature_cache=None):
+    """Loads the MOER dataset once per worker process (with a feature cache, features are loaded per scenario)."""
+    if feature_cache is None:
+        _worker_data["initial"], _worker_data["sim"] = load_moer_data(data_path)
+    _worker_data["data_path"] = data_path
+    _worker_data["feature_cache"] = feature_cache
+    _worker_data["features"] = {}
+
+
+def _load_worker_features(hist_bucket_mins, seed_first_day):
+    """Loads the MOER features for a bucket size and seeding from the feature cache, once per worker process."""
+    key = (hist_bucket_mins, seed_first_day)
+    if key not in _worker_data["features"]:
+        _worker_data["features"][key] = load_moer_features(_worker_data["data_path"], _worker_data["feature_cache"],
+                                                           hist_bucket_mins, seed_first_day)
+    return _worker_data["features"][key]
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    with open(args.grid) as grid_file:
+        grid_spec = json.load(grid_file)
+    run_sweep(grid_spec, args.data_path, args.output_dir, workers=args.workers, plot=args.plot,
+              trace_format=args.trace_format, fork_from=args.fork_from, feature_cache=args.feature_cache)
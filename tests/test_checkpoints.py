@@ -0,0 +1,57 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+from refrigerator_sim import load_moer_data, stream_moer_data
+from simulator import Simulator, parse_policy
+from trace_files import load_trace
+from test_feature_cache import write_dataset
+
+INTERRUPTED_TIMESTEPS = 250  # the interrupted run dies after this many timesteps, 50 after its last checkpoint
+CHECKPOINT_EVERY = 100
+
+
+def run(moer_data, output_dir, num_timesteps, trace_format, policy="zeroes_forecast_hist", **run_options):
+    """Runs a policy with the dp engine, and returns the Simulator."""
+    output_dir.mkdir(exist_ok=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        simulator = Simulator(moer_data, str(output_dir), num_timesteps, trace_format=trace_format)
+        simulator.run(engine="dp", plot=False, **parse_policy(policy), **run_options)
+    return simulator
+
+
+def read_bytes(path):
+    with open(path, 'rb') as trace_file:
+        return trace_file.read()
+
+
+@pytest.mark.parametrize("trace_format,streamed", [("csv", False), ("npy", False), ("csv", True)])
+def test_resumed_and_forked_runs(tmp_path, trace_format, streamed):
+    data_path = str(tmp_path / "moers.csv")
+    write_dataset(data_path)
+
+    def moer_data():
+        return stream_moer_data(data_path, chunk_rows=50)[1] if streamed else load_moer_data(data_path)[1]
+
+    num_timesteps = None if streamed else len(load_moer_data(data_path)[1])
+    uninterrupted = run(moer_data(), tmp_path / "uninterrupted", num_timesteps, trace_format)
+
+    # a run that dies after its second checkpoint, having written some rows past it, and is resumed in place
+    interrupted = run(moer_data(), tmp_path / "resumed", INTERRUPTED_TIMESTEPS, trace_format,
+                      checkpoint_every=CHECKPOINT_EVERY)
+    checkpoint_path = interrupted.output_filename[:-len(trace_format) - 1] + "_checkpoint.pkl"
+    resumed = run(moer_data(), tmp_path / "resumed", num_timesteps, trace_format, resume_from=checkpoint_path)
+    assert read_bytes(resumed.output_filename) == read_bytes(uninterrupted.output_filename)
+    assert resumed.total_lbs_co2 == pytest.approx(uninterrupted.total_lbs_co2)
+
+    # a fork from the same checkpoint, with another policy from the checkpoint on
+    forked = run(moer_data(), tmp_path / "forked", num_timesteps, trace_format, policy="no_data",
+                 resume_from=checkpoint_path)
+    forked_trace, uninterrupted_trace = load_trace(forked.output_filename), load_trace(uninterrupted.output_filename)
+    checkpoint_rows = 2 * CHECKPOINT_EVERY
+    assert len(forked_trace["time"]) == len(uninterrupted_trace["time"])
+    for column in Simulator.TRACE_COLUMNS:
+        np.testing.assert_array_equal(forked_trace[column][:checkpoint_rows],
+                                      uninterrupted_trace[column][:checkpoint_rows])
+    assert not np.array_equal(forked_trace["fridge_on"], uninterrupted_trace["fridge_on"])
+    assert forked.total_lbs_co2 == pytest.approx(forked_trace["lbs_co2"].sum())
@@ -0,0 +1,54 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from controller import RealTimeController
+
+
+class SlowOnceEngine:
+    """A fake decision engine that always turns the fridge on, and takes slow_secs on its slow_call-th call."""
+    name = "slow_once"
+
+    def __init__(self, slow_call, slow_secs):
+        self.slow_call = slow_call
+        self.slow_secs = slow_secs
+        self.decides = 0  # unlike calls, not reset by the controller's warm-up
+        self.calls = 0
+        self.build_secs = 0.0
+        self.solve_secs = 0.0
+
+    def decide(self, moer_vector, current_temp, step_sizes=None):
+        self.calls += 1
+        self.decides += 1
+        if self.decides == self.slow_call:
+            time.sleep(self.slow_secs)
+        return 1
+
+
+async def busy_messages(num_messages, handling_secs=0.001):
+    """MOER messages from a source that never waits, so the event loop never runs between messages."""
+    start = datetime(2019, 3, 1)
+    for row in range(num_messages):
+        time.sleep(handling_secs)  # the controller's other per-message work, without yielding to the event loop
+        timestamp = (start + timedelta(minutes=5 * row)).isoformat()
+        yield {"timestamp": timestamp, "moer": 500, "forecast": [500] * 12}
+
+
+def test_decisions_recover_after_deadline_miss():
+    controller = RealTimeController(deadline_ms=20, use_hist=False)
+    # the first call is the warm-up, the second the first decision: it misses its deadline by far
+    controller.engine = SlowOnceEngine(slow_call=2, slow_secs=0.1)
+    stats = asyncio.run(controller.run(busy_messages(300)))
+
+    assert stats["deadline_misses"] == 1
+    assert 0 < stats["busy_fallbacks"] < 150
+    assert stats["decisions"]["forecast"] == 300 - 1 - stats["busy_fallbacks"]
+
+
+def test_warm_up_is_not_counted_against_the_deadline():
+    controller = RealTimeController(deadline_ms=20, use_hist=False)
+    controller.engine = SlowOnceEngine(slow_call=1, slow_secs=0.1)
+    stats = asyncio.run(controller.run(busy_messages(50)))
+
+    assert stats["deadline_misses"] == 0
+    assert stats["decisions"]["forecast"] == 50
+    assert controller.engine.calls == 50
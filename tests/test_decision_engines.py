@@ -0,0 +1,130 @@
+import itertools
+import numpy as np
+import pytest
+from decision_engines import DP_TOLERANCE, create_engine, first_decisions, optimal_schedule
+from refrigerator import Refrigerator
+
+MINS_PER_TIMESTEP = 5
+
+
+def schedule_cost(schedule, moers, current_temp, warming_step, cooling_step, min_temp, max_temp, step_sizes):
+    """
+    :return: the cost of an on/off schedule (the number of on-timesteps of every step), or infinity if it leaves the
+             band at the end of any step but the last (the forecast window problem of LpDecisionEngine)
+    """
+    temp = current_temp
+    for on_steps, step_size in zip(schedule[:-1], step_sizes[:-1]):
+        temp += on_steps * cooling_step + (step_size - on_steps) * warming_step
+        if not min_temp - DP_TOLERANCE <= temp <= max_temp + DP_TOLERANCE:
+            return np.inf
+    return float(np.dot(schedule, moers))
+
+
+def brute_force_costs(moers, current_temp, warming_step, cooling_step, min_temp, max_temp, step_sizes=None):
+    """
+    :return: (cost_off, cost_on): the cheapest cost of every schedule that starts off, and that starts on
+    """
+    if step_sizes is None:
+        step_sizes = np.ones(moers.size, dtype=np.int64)
+    costs = {False: np.inf, True: np.inf}
+    for schedule in itertools.product(*[range(step_size + 1) for step_size in step_sizes]):
+        cost = schedule_cost(schedule, moers, current_temp, warming_step, cooling_step, min_temp, max_temp,
+                             step_sizes)
+        costs[schedule[0] > 0] = min(costs[schedule[0] > 0], cost)
+    return costs[False], costs[True]
+
+
+def random_windows(num_windows, max_window, seed):
+    """
+    Random forecast windows, with few distinct MOERs (so that there are ties), and in-band start temperatures: half of
+    them anywhere in the band, half on the lattice of temperatures the simulated fridge actually reaches (where
+    windows often end exactly on the band's edges).
+    """
+    rng = np.random.default_rng(seed)
+    fridge = Refrigerator()
+    warming_step = fridge.WARMING_RATE * MINS_PER_TIMESTEP
+    for window in range(num_windows):
+        moers = rng.integers(0, 6, rng.integers(1, max_window + 1)) * 100.0
+        if window % 2:
+            yield moers, rng.uniform(fridge.MIN_TEMP, fridge.MAX_TEMP)
+        else:
+            yield moers, fridge.MIN_TEMP + rng.integers(0, 25) * warming_step
+
+
+@pytest.mark.parametrize("engine_name", ["dp", "lp", "highs"])
+def test_engine_first_decision_is_optimal(engine_name):
+    if engine_name == "highs":
+        pytest.importorskip("highspy")
+    fridge = Refrigerator()
+    engine = create_engine(engine_name, fridge, MINS_PER_TIMESTEP)
+    warming_step, cooling_step = fridge.WARMING_RATE * MINS_PER_TIMESTEP, fridge.COOLING_RATE * MINS_PER_TIMESTEP
+    for moers, current_temp in random_windows(60, 8, seed=1):
+        cost_off, cost_on = brute_force_costs(moers, current_temp, warming_step, cooling_step, fridge.MIN_TEMP,
+                                              fridge.MAX_TEMP)
+        decision = engine.decide(moers, current_temp)
+        # the decision starts an optimal schedule; any of several equally cheap ones will do
+        assert (cost_on if decision else cost_off) == pytest.approx(min(cost_off, cost_on))
+
+
+@pytest.mark.parametrize("engine_name", ["dp", "lp", "highs"])
+def test_engine_decides_month_window(engine_name):
+    # timestep 41 of the month's --zeroes --forecast run, where CBC returned -2.6e-12 for an optimal "off" status
+    if engine_name == "highs":
+        pytest.importorskip("highspy")
+    fridge = Refrigerator()
+    engine = create_engine(engine_name, fridge, MINS_PER_TIMESTEP)
+    moers = np.array([1278.0, 1234.0, 1164.0, 1117.0, 1082.0, 1082.0, 1080.0, 1120.0, 1117.0, 1117.0, 1170.0, 1170.0])
+    decision = engine.decide(moers, 42.583333333333236)
+    assert decision == 0 and isinstance(decision, int)
+
+
+def test_batched_first_decisions_are_optimal():
+    # fridges with different bands and rates, and windows of coarse steps, side by side in one batch
+    rng = np.random.default_rng(2)
+    for _ in range(40):
+        num_steps = rng.integers(2, 6)
+        step_sizes = rng.integers(1, 4, num_steps)
+        moers = rng.integers(0, 6, num_steps) * 100.0
+        min_temps = rng.uniform(31, 35, 8)
+        max_temps = min_temps + rng.uniform(3, 12, 8)
+        warming_steps = rng.uniform(0.2, 0.6, 8)
+        cooling_steps = -rng.uniform(0.5, 1.2, 8)
+        current_temps = rng.uniform(min_temps, max_temps)
+        decisions = first_decisions(moers, current_temps, warming_steps, cooling_steps, min_temps, max_temps,
+                                    step_sizes)
+        for fridge in range(8):
+            cost_off, cost_on = brute_force_costs(moers, current_temps[fridge], warming_steps[fridge],
+                                                  cooling_steps[fridge], min_temps[fridge], max_temps[fridge],
+                                                  step_sizes)
+            if np.isinf(min(cost_off, cost_on)):
+                continue  # no schedule keeps this fridge in band
+            assert (cost_on if decisions[fridge] else cost_off) == pytest.approx(min(cost_off, cost_on))
+
+
+@pytest.mark.parametrize("engine_name", ["dp", "lp"])
+def test_engine_coarse_step_decision_is_optimal(engine_name):
+    fridge = Refrigerator()
+    engine = create_engine(engine_name, fridge, MINS_PER_TIMESTEP)
+    warming_step, cooling_step = fridge.WARMING_RATE * MINS_PER_TIMESTEP, fridge.COOLING_RATE * MINS_PER_TIMESTEP
+    rng = np.random.default_rng(3)
+    for moers, current_temp in random_windows(40, 5, seed=3):
+        step_sizes = rng.integers(1, 4, moers.size)
+        cost_off, cost_on = brute_force_costs(moers, current_temp, warming_step, cooling_step, fridge.MIN_TEMP,
+                                              fridge.MAX_TEMP, step_sizes)
+        decision = engine.decide(moers, current_temp, step_sizes)
+        assert (cost_on if decision else cost_off) == pytest.approx(min(cost_off, cost_on))
+
+
+def test_optimal_schedule_matches_exhaustive_search():
+    fridge = Refrigerator()
+    warming_step, cooling_step = fridge.WARMING_RATE * MINS_PER_TIMESTEP, fridge.COOLING_RATE * MINS_PER_TIMESTEP
+    for step_costs, initial_temp in random_windows(60, 10, seed=4):
+        cost_off, cost_on = brute_force_costs(step_costs, initial_temp, warming_step, cooling_step, fridge.MIN_TEMP,
+                                              fridge.MAX_TEMP)
+        schedule, cost = optimal_schedule(step_costs, initial_temp, warming_step, cooling_step, fridge.MIN_TEMP,
+                                          fridge.MAX_TEMP)
+        assert cost == pytest.approx(min(cost_off, cost_on))
+        # the schedule itself keeps the fridge in band, at the reported cost
+        assert schedule_cost(schedule.astype(int), step_costs, initial_temp, warming_step, cooling_step,
+                             fridge.MIN_TEMP, fridge.MAX_TEMP, np.ones(step_costs.size, dtype=int)) == \
+            pytest.approx(cost)
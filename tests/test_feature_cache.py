@@ -0,0 +1,32 @@
+import glob
+import os
+import numpy as np
+import pandas as pd
+from feature_cache import load_moer_features
+
+
+def write_dataset(path, days=3):
+    """Writes a MOER dataset of some days of 5 minute rows, in the format of MOER_Data/MOERS.csv."""
+    timestamps = pd.date_range("2019-02-28", periods=days * 288, freq="5min", tz="UTC")
+    moers = np.random.default_rng(0).integers(0, 1000, len(timestamps))
+    pd.DataFrame({"timestamp": timestamps.astype(str), "MOER": moers}).to_csv(path, index=False)
+
+
+def test_truncated_cache_file_is_recomputed(tmp_path):
+    data_path = str(tmp_path / "moers.csv")
+    cache_dir = str(tmp_path / "cache")
+    write_dataset(data_path)
+    features = load_moer_features(data_path, cache_dir)
+    cache_path, = glob.glob(os.path.join(cache_dir, "*.npz"))
+
+    with open(cache_path, 'r+b') as cache_file:
+        cache_file.truncate(os.path.getsize(cache_path) // 2)
+    recomputed = load_moer_features(data_path, cache_dir)
+    cached = load_moer_features(data_path, cache_dir)  # from the overwritten cache file
+
+    for loaded in (recomputed, cached):
+        np.testing.assert_array_equal(loaded.moers, features.moers)
+        np.testing.assert_array_equal(loaded.timeslot_ids, features.timeslot_ids)
+        np.testing.assert_array_equal(loaded.hist_avgs, features.hist_avgs)
+        np.testing.assert_array_equal(loaded.hist_datapoints, features.hist_datapoints)
+    assert glob.glob(os.path.join(cache_dir, "*")) == [cache_path]
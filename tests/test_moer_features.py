@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+from feature_cache import MoerFeatures
+from moer_features import HORIZON_PROFILES, RunningHistoricalAverages, hist_extension_length
+from simulator import Simulator
+
+TIMESTEPS_PER_DAY = 288
+
+
+def make_moer_data(days=3):
+    """A dataframe of some days of 5 minute rows with positive MOERs, in the format of MOER_Data/MOERS.csv."""
+    timestamps = pd.date_range("2019-03-01", periods=days * TIMESTEPS_PER_DAY, freq="5min", tz="UTC")
+    moers = np.random.default_rng(0).integers(1, 1000, len(timestamps)).astype(float)
+    return pd.DataFrame({"timestamp": timestamps.astype(str), "MOER": moers})
+
+
+def incremental_historical_averages(moers, timeslot_ids):
+    """
+    The historical averages as the Simulator originally updated them, one timestep at a time: each timestep's MOER
+    enters the running average of its slot, which becomes the average of the same timestep one day later.
+    """
+    historicals = {}
+    averages = np.zeros(len(moers))
+    datapoints = np.zeros(len(moers), dtype=np.int64)
+    for timestep, (moer, slot) in enumerate(zip(moers, timeslot_ids)):
+        datapoints[timestep] = historicals.get(slot, (0, 0))[1]
+        avg, count = moer, 1
+        if slot in historicals:
+            old_avg, count = historicals[slot]
+            avg = (count * old_avg + moer) / (count + 1)
+            count += 1
+        historicals[slot] = (avg, count)
+        if timestep + TIMESTEPS_PER_DAY < len(moers):
+            averages[timestep + TIMESTEPS_PER_DAY] = avg
+    return averages, datapoints
+
+
+def test_historical_averages_match_incremental_updates():
+    features = MoerFeatures.compute(make_moer_data(), 5, 5)
+    averages, datapoints = incremental_historical_averages(features.moers, features.timeslot_ids)
+    np.testing.assert_allclose(features.hist_avgs, averages)
+    np.testing.assert_array_equal(features.hist_datapoints, datapoints)
+
+
+@pytest.mark.parametrize("bucket_mins", [5, 15, 60])
+def test_running_averages_match_batch(bucket_mins):
+    features = MoerFeatures.compute(make_moer_data(), bucket_mins, 5)
+    running_averages = RunningHistoricalAverages(24 * 60 // bucket_mins, TIMESTEPS_PER_DAY)
+    running = [running_averages.add(slot, moer) for slot, moer in zip(features.timeslot_ids, features.moers)]
+    np.testing.assert_allclose([average for average, _ in running], features.hist_avgs)
+    np.testing.assert_array_equal([datapoints for _, datapoints in running], features.hist_datapoints)
+
+
+@pytest.mark.parametrize("bucket_mins", [5, 15, 60])
+def test_forecast_is_only_extended_with_history(bucket_mins):
+    # the MOERs are all positive, so a zero average is a placeholder for a slot without history
+    lookahead_window, max_hist_extension = 12, 6
+    features = MoerFeatures.compute(make_moer_data(), bucket_mins, 5)
+    for timestep in range(len(features) - lookahead_window - max_hist_extension):
+        extension = hist_extension_length(features.hist_datapoints[timestep], max_hist_extension)
+        hist_start = timestep + lookahead_window
+        assert np.all(features.hist_avgs[hist_start: hist_start + extension] > 0)
+    assert np.all(features.hist_datapoints[:TIMESTEPS_PER_DAY] == 0)
+
+
+def test_horizon_must_cover_forecast_window():
+    moer_data = make_moer_data(days=2)
+    simulator = Simulator(moer_data, ".", len(moer_data), lookahead_mins=240, horizon_profile=HORIZON_PROFILES["4h"])
+    assert simulator.window_rows == 48
+    with pytest.raises(Exception, match="shorter than the 240 minute forecast window"):
+        Simulator(moer_data, ".", len(moer_data), lookahead_mins=240, horizon_profile=HORIZON_PROFILES["1h"])
@@ -0,0 +1,35 @@
+import contextlib
+import io
+import pytest
+from moer_features import HORIZON_PROFILES
+from refrigerator_sim import load_moer_data, stream_moer_data
+from simulator import Simulator
+from test_feature_cache import write_dataset
+
+
+def run_best(moer_data, output_dir, num_timesteps, **simulator_kwargs):
+    """Runs the best policy with the dp engine, and returns the trace file's contents."""
+    output_dir.mkdir()
+    with contextlib.redirect_stdout(io.StringIO()):
+        simulator = Simulator(moer_data, str(output_dir), num_timesteps, **simulator_kwargs)
+        output_filename = simulator.run(use_zeroes=True, use_forecast=True, use_hist=True, engine="dp", plot=False)
+    with open(output_filename, 'rb') as trace_file:
+        return trace_file.read()
+
+
+@pytest.mark.parametrize("settings", [{}, {"horizon_profile": HORIZON_PROFILES["12h"]},
+                                      {"seed_first_day": True, "hist_bucket_mins": 15}])
+def test_streamed_trace_matches_in_memory_trace(tmp_path, settings):
+    data_path = str(tmp_path / "moers.csv")
+    write_dataset(data_path)
+    seed_first_day = settings.get("seed_first_day", False)
+    simulator_kwargs = {name: value for name, value in settings.items() if name != "seed_first_day"}
+
+    initial_historical_data, sim_moer_data = load_moer_data(data_path)
+    in_memory = run_best(sim_moer_data, tmp_path / "in_memory", len(sim_moer_data),
+                         seed_data=initial_historical_data if seed_first_day else None, **simulator_kwargs)
+    # chunks of 7 rows, much smaller than the forecast window (and the 12 hour horizon)
+    initial_historical_data, stream = stream_moer_data(data_path, chunk_rows=7)
+    streamed = run_best(stream, tmp_path / "streamed", None,
+                        seed_data=initial_historical_data if seed_first_day else None, **simulator_kwargs)
+    assert streamed == in_memory
@@ -0,0 +1,23 @@
+import pytest
+from simulator import parse_policy
+from sweep import expand_grid
+
+
+def test_parse_policy():
+    assert parse_policy("no_data") == {"use_zeroes": False, "use_forecast": False, "use_hist": False}
+    assert parse_policy("forecast_hist") == {"use_zeroes": False, "use_forecast": True, "use_hist": True}
+    for name in ["forcast", "best", "", "forecast_zeroes", "zeroes_zeroes", "hist", "zeroes_hist"]:
+        with pytest.raises(Exception):
+            parse_policy(name)
+
+
+def test_grid_with_invalid_policy_is_rejected():
+    assert len(expand_grid({"policy": ["no_data", "zeroes_forecast_hist"]})) == 2
+    with pytest.raises(Exception, match="forcast"):
+        expand_grid({"policy": ["zeroes", "zeroes_forcast"]})
+
+
+def test_grid_with_too_short_horizon_is_rejected():
+    assert len(expand_grid({"lookahead_mins": [60, 240], "horizon": "4h"})) == 2
+    with pytest.raises(Exception, match="shorter than the 240 minute forecast window"):
+        expand_grid({"lookahead_mins": [60, 240], "horizon": "1h"})
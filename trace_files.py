@@ -0,0 +1,76 @@
+import numpy as np
+
+# File formats a simulation trace can be written in: text (one row per line) or a binary .npy file of records, which
+# can be opened memory-mapped without parsing
+TRACE_FORMATS = ["csv", "npy"]
+
+
+class NpyTraceWriter:
+    """
+    Writer of a simulation trace as a .npy file holding one structured array (one record per timestep, one field per
+    trace column), appended to in chunks.  The .npy header is rewritten with the number of records after every
+    append, so the file is a complete, loadable array between appends.  The file is created (overwriting any existing
+    file) by the first append, unless the writer continues an existing trace (see resume).
+    """
+
+    def __init__(self, path, dtype):
+        """
+        :param path: path of the .npy file
+        :param dtype: numpy structured dtype of one record
+        """
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.num_records = 0
+        self.data_offset = None
+
+    def resume(self, num_records):
+        """
+        Continues the existing trace at path after its first num_records records, dropping any records after them.
+
+        :param num_records: the number of records of the existing trace to keep
+        """
+        with open(self.path, 'r+b') as trace_file:
+            np.lib.format.read_magic(trace_file)
+            np.lib.format.read_array_header_1_0(trace_file)
+            self.data_offset = trace_file.tell()
+            self.num_records = num_records
+            trace_file.truncate(self.data_offset + num_records * self.dtype.itemsize)
+            trace_file.seek(0)
+            self._write_header(trace_file)
+
+    def append(self, records):
+        """
+        :param records: numpy structured array of the next records, of the writer's dtype
+        """
+        if self.data_offset is None:
+            with open(self.path, 'wb') as trace_file:
+                self._write_header(trace_file)
+                self.data_offset = trace_file.tell()
+        with open(self.path, 'r+b') as trace_file:
+            trace_file.seek(self.data_offset + self.num_records * self.dtype.itemsize)
+            trace_file.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+            self.num_records += len(records)
+            trace_file.seek(0)
+            self._write_header(trace_file)
+
+    def _write_header(self, trace_file):
+        np.lib.format.write_array_header_1_0(trace_file, {"descr": np.lib.format.dtype_to_descr(self.dtype),
+                                                          "fortran_order": False, "shape": (self.num_records,)})
+        if self.data_offset is not None and trace_file.tell() != self.data_offset:
+            raise Exception("The .npy header of {} changed size, the trace can't be appended to.".format(self.path))
+
+
+def load_trace(path):
+    """
+    Opens a simulation trace written in any of TRACE_FORMATS.  .npy traces are memory-mapped, so only the columns (and
+    rows) that are used are read from disk.
+
+    :param path: path of the trace file, its extension is its format
+    :return: dict of column name to numpy array (a read-only memory-mapped view for .npy traces)
+    """
+    if path.endswith(".npy"):
+        records = np.load(path, mmap_mode='r')
+        return {column: records[column] for column in records.dtype.names}
+    import pandas as pd  # deferred, only csv traces need pandas
+    data = pd.read_csv(path)
+    return {column: data[column].to_numpy() for column in data.columns}
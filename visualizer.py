@@ -1,45 +1,53 @@
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 from matplotlib.lines import Line2D
-import pandas as pd
+import numpy as np
+import os
+from trace_files import load_trace
 
 
 class Visualizer:
     """ A class for visualizing the output data of an AER simulation. """
 
-    def __init__(self, simulator):
+    def __init__(self, simulator, output_format="pdf", max_points=None):
         """
         :param simulator: A reference to the Simulator object this Visualizer belongs to.
+        :param output_format: The file format of saved plots, e.g. "pdf" (vector) or "png" (raster).
+        :param max_points: If set, longer traces are decimated to about this many points per line, keeping the
+                           minimum and maximum of every stretch of data so that no peaks are lost.
         """
         self.simulator = simulator
+        self.output_format = output_format
+        self.max_points = max_points
 
     def plot(self, path_to_data):
-        """ Generate and save a pdf plot displaying simulation results including:
+        """ Generate and save a plot displaying simulation results including:
                 - The internal temperature of the refrigerator, as a function of time
                 - The MOER data at each timestep of the simulation
                 - The cumulative total lbs of CO2 that the refrigerator has consumed as a function of time
 
         Note: plot will be saved in output directory specified in Simulator object.
 
-        :param path_to_data: the path to the csv file containing simulation data.
+        :param path_to_data: the path to the csv (or memory-mapped npy) file containing simulation data.
         """
-        data = pd.read_csv(path_to_data)
-        sim_id = path_to_data.lstrip(self.simulator.output_dir).rstrip('.csv').lstrip('/sim_output_')
+        data = load_trace(path_to_data)
+        sim_id = os.path.splitext(os.path.basename(path_to_data))[0][len('sim_output_'):]
 
         fig, axs = plt.subplots(3, 1, sharex=True, gridspec_kw={'hspace': 0})
         fig.set_size_inches(12, 7)
         title_suffix = " ".join([string.capitalize() for string in sim_id.split("_")])
         fig.suptitle("Simple AER Simulation: " + title_suffix)
 
-        # plot fridge temp color-coded by on/off
-        for t1, t2, status, y1, y2 in zip(data['time'],
-                                          data['time'][1:],
-                                          data['fridge_on'],
-                                          data['fridge_temp'],
-                                          data['fridge_temp'][1:]):
-            if status:
-                axs[0].plot([t1, t2], [y1, y2], 'b')
-            else:
-                axs[0].plot([t1, t2], [y1, y2], 'r')
+        # plot fridge temp color-coded by on/off: one segment per timestep, colored by the status during that timestep
+        times = data['time']
+        temps = data['fridge_temp']
+        statuses = data['fridge_on'].astype(bool)
+        kept = self._decimate(temps)
+        points = np.column_stack((times[kept], temps[kept]))
+        segments = np.stack((points[:-1], points[1:]), axis=1)
+        colors = np.where(statuses[kept][:-1, np.newaxis], [[0, 0, 1, 1]], [[1, 0, 0, 1]])
+        axs[0].add_collection(LineCollection(segments, colors=colors))
+        axs[0].set_xlim(times[0], times[-1])
         axs[0].set_ylabel('Refrigerator \nTemperature \n(F)', rotation=0, labelpad=42)
         axs[0].set_ylim([30, 45])
         axs[0].set_yticks(range(33, 44))
@@ -50,19 +58,22 @@ class Visualizer:
 
         # plot moer
         axs[1].set_ylabel('MOER \n(lbs CO2 / Mwh)', rotation=0, labelpad=42)
-        axs[1].plot(data["time"], data["moer"])
-
-        # plot cumulative CO2 usage
-        cumulative_total = 0
-        for t1, co2, t2 in zip(data['time'], data['lbs_co2'], data['time'][1:]):
-            new_total = cumulative_total + co2
-            axs[2].plot([t1, t2], [cumulative_total, new_total], 'b')
-            cumulative_total = new_total
-        cumulative_total += data['lbs_co2'][data.shape[0] - 1] # don't forget last entry that's getting lost by the zip
+        moers = data['moer']
+        kept = self._decimate(moers)
+        axs[1].plot(times[kept], moers[kept])
+
+        # plot cumulative CO2 usage (the total before each timestep's emissions)
+        cumulative = np.cumsum(data['lbs_co2'])
+        cumulative_total = cumulative[-1]
+        cumulative_before = np.concatenate(([0], cumulative[:-1]))
+        kept = self._decimate(cumulative_before)
+        axs[2].plot(times[kept], cumulative_before[kept], 'b')
         axs[2].set_ylabel('Cumulative \nlbs CO2', rotation=0, labelpad=42)
 
         axs[2].set_xlabel('Elapsed Time (min)')
-        xticks = data['time'][::288 // 2]
+        num_months = int(np.ceil(len(times) / (288 * 31)))
+        tick_step = 288 // 2 if num_months <= 1 else 288 * num_months  # twice a day for a month, sparser beyond that
+        xticks = times[::tick_step]
         mapper = map(self._create_xlabel_for_time, xticks)
         xtick_labels = list(mapper)
         axs[2].set_xticks(xticks)
@@ -75,26 +86,49 @@ class Visualizer:
                     transform=axs[2].transAxes,
                     color='green', fontsize=15)
 
-        fig.savefig(self.simulator.output_dir.rstrip('/') + '/' + 'plots_' + sim_id + ".pdf")
+        fig.savefig(self.simulator.output_dir.rstrip('/') + '/' + 'plots_' + sim_id + "." + self.output_format)
+        plt.close(fig)
         return
 
-    def plot_avg_moers(self, path_to_data):
+    def plot_avg_moers(self, times, avg_moers):
         """ Generate and save a plot of the average MOER for each time of day, for duration of simulation timespan.
 
         Note: plot will be saved in output directory specified in Simulator object.
 
-        :param path_to_data: the path to the csv file containing simulation data.
+        :param times: the elapsed simulation time (minutes) at each timestep
+        :param avg_moers: the historical average MOER at each timestep
         """
-        data = pd.read_csv(path_to_data)
+        bucket_mins = self.simulator.hist_bucket_mins
         fig, ax = plt.subplots()
         ax.set_ylabel('AVG MOER \n(lbs CO2 / Mwh)', rotation=0, labelpad=42)
-        ax.plot(data["time"], data["avg_moer_at_time"])
+        ax.plot(times, avg_moers)
         fig.set_size_inches(8, 5)
-        fig.suptitle("Average Historical MOER: Granularity = timestep")
+        fig.suptitle("Average Historical MOER: Granularity = {} min".format(bucket_mins))
         fig.tight_layout()
-        fig.savefig(self.simulator.output_dir.rstrip('/') + '/' + 'avgMOERs_timestep_granularity.pdf')
+        fig.savefig(self.simulator.output_dir.rstrip('/') + '/' +
+                    'avgMOERs_{}min_granularity.{}'.format(bucket_mins, self.output_format))
+        plt.close(fig)
         return
 
+    def _decimate(self, values):
+        """
+        Picks the points of a series to plot.  If the series is longer than self.max_points, it is split into
+        max_points / 2 stretches and only the minimum and maximum of each stretch (plus the last point) are kept, so
+        the plotted line still covers the full range of the data.
+
+        :param values: numpy array of the series' values
+        :return: sorted numpy array of the indices of the points to plot
+        """
+        if self.max_points is None or values.size <= self.max_points:
+            return np.arange(values.size)
+        num_buckets = max(1, self.max_points // 2)
+        bucket_size = int(np.ceil(values.size / num_buckets))
+        padded = np.pad(values.astype(float), (0, num_buckets * bucket_size - values.size), mode='edge')
+        buckets = padded.reshape(num_buckets, bucket_size)
+        starts = np.arange(num_buckets) * bucket_size
+        kept = np.concatenate((starts + buckets.argmin(axis=1), starts + buckets.argmax(axis=1), [values.size - 1]))
+        return np.unique(np.minimum(kept, values.size - 1))
+
     def _create_xlabel_for_time(self, minutes_elapsed):
         minutes_per_day = 60 * 24
         day = minutes_elapsed // minutes_per_day